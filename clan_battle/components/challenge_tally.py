@@ -0,0 +1,66 @@
+from typing import Any, Callable, Dict, Iterable, List, Sequence
+
+
+def member_blades(challenge_model: Any, group_id: int, battle_id: int, pcrdate: int) -> Dict[int, List[Any]]:
+	"""
+	当天全公会的出刀记录一次查出  按成员累计  不再每个成员查询一次
+	按cid顺序逐条累加  与逐个成员统计时的加法顺序相同  出刀数的int/float类型(3 与 3.0)也相同
+
+	:param challenge_model: 出刀记录表  即 ybdata.Clan_challenge
+	:return: {qq号: [出刀数, 剩余补偿刀数量]}  当天没有出刀的成员不在其中
+	"""
+	challenge_records = challenge_model.select(
+		challenge_model.qqid,
+		challenge_model.boss_health_remain,
+		challenge_model.is_continue,
+	).where(
+		challenge_model.gid == group_id,
+		challenge_model.bid == battle_id,
+		challenge_model.challenge_pcrdate == pcrdate,
+	).order_by(challenge_model.cid)
+	blades = {}
+	for c in challenge_records:
+		tally = blades.get(c.qqid)
+		if tally is None: tally = blades[c.qqid] = [0, 0]
+		if c.boss_health_remain == 0 and not c.is_continue:	#完整刀收尾算0.5刀
+			tally[0] += 0.5
+			tally[1] += 1
+		elif c.is_continue:	#补偿刀算0.5刀
+			tally[0] += 0.5
+			tally[1] -= 1
+		else: tally[0] += 1
+	return blades
+
+
+def record_message(member_qqids: Sequence[int], blades: Dict[int, List[Any]], nickname: Callable[[int], str]) -> str:
+	"""
+	出刀记录的回复
+
+	:param member_qqids: 公会成员  按成员表的顺序
+	:param blades: member_blades 的结果  不是成员的记录不计入
+	:param nickname: 由qq号取昵称
+	"""
+	total_blade_num = 0				#总出刀数
+	total_continue_blade_num = 0	#总补偿刀数量
+	zero_blade_members = []			#一刀没出的成员
+	blade_list = {}
+	for qqid in member_qqids:
+		if qqid in blades:
+			member_num, continue_blade_num = blades[qqid]	#单个成员出刀数  单个成员剩余补偿刀数量
+			total_blade_num += member_num
+			total_continue_blade_num += continue_blade_num
+			if member_num not in blade_list: blade_list[member_num] = 1
+			else: blade_list[member_num] += 1
+		else:
+			zero_blade_members.append(qqid)
+
+	back_msg = []
+	back_msg.append(f"待出补偿刀数量：{total_continue_blade_num}")
+	back_msg.append(f"已出0刀的成员数量：{len(zero_blade_members)}")
+	for i in range(len(zero_blade_members)):
+		name = nickname(zero_blade_members[i])
+		back_msg.append(f"{i == len(zero_blade_members)-1 and '┖' or '┣'}{name}")
+	for blade_num in blade_list.keys():
+		back_msg.append(f"已出{blade_num}刀：{blade_list[blade_num]}")
+	back_msg.append(f"今天已出 {total_blade_num}/{len(member_qqids)*3}")
+	return '\n'.join(back_msg)
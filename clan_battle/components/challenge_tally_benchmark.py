@@ -0,0 +1,231 @@
+"""
+出刀记录(challenge_record)的查询次数与耗时测试
+
+在临时的SQLite数据库中生成一天的公会战数据: 30名成员  2人未出刀  已退会成员的记录  其他日期、其他公会的记录
+分别以改写前逐个成员查询的方式和 challenge_tally 统计  比较回复是否相同  并记录查询次数与耗时
+表结构与 ybdata 中的 Clan_member / Clan_challenge 一致(只保留用到的字段)  不依赖yobot的其他部分
+
+用法:
+	python -m clan_battle.components.challenge_tally_benchmark
+	python -m clan_battle.components.challenge_tally_benchmark --repeat 500 --noise 20000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import peewee
+
+from .challenge_tally import member_blades, record_message
+
+GROUP_ID = 1000
+BATTLE_ID = 3
+PCRDATE = 42
+MEMBER_NUM = 30
+FIRST_QQ = 10000
+# 各成员当天的出刀  n: 普通刀  e: 击破boss的完整刀(剩余血量0)  c: 补偿刀
+# 依次为 3.0刀(float)  3刀(int)  2.5刀并留有补偿  1.0刀
+# 3 与 3.0 在统计中是同一个键  回复中显示先出现的成员的类型
+BLADE_PATTERNS = (("e", "c", "n", "n"), ("n", "n", "n"), ("n", "e", "n"), ("e", "c"))
+# 未出刀的成员数  排在成员表末尾
+ZERO_BLADE_NUM = 2
+# 已退会成员当天的出刀  不计入统计
+FORMER_MEMBER_BLADES = ("n", "e", "c", "n", "n", "n")
+
+database = peewee.DatabaseProxy()
+
+
+class Clan_member(peewee.Model):
+	group_id = peewee.BigIntegerField()
+	qqid = peewee.BigIntegerField()
+	role = peewee.IntegerField(default=100)
+
+	class Meta:
+		database = database
+		primary_key = peewee.CompositeKey('group_id', 'qqid')
+
+
+class Clan_challenge(peewee.Model):
+	cid = peewee.AutoField(primary_key=True)
+	bid = peewee.IntegerField()
+	gid = peewee.BigIntegerField()
+	qqid = peewee.BigIntegerField()
+	challenge_pcrdate = peewee.IntegerField()
+	challenge_pcrtime = peewee.IntegerField(default=0)
+	boss_cycle = peewee.SmallIntegerField(default=1)
+	boss_num = peewee.SmallIntegerField(default=1)
+	boss_health_remain = peewee.BigIntegerField()
+	challenge_damage = peewee.BigIntegerField(default=0)
+	is_continue = peewee.BooleanField()
+	message = peewee.TextField(null=True)
+	behalf = peewee.IntegerField(null=True)
+
+	class Meta:
+		database = database
+		indexes = (
+			(('bid', 'gid'), False),
+			(('qqid', 'challenge_pcrdate'), False),
+			(('bid', 'gid', 'challenge_pcrdate'), False),
+		)
+
+
+class CountingDatabase(peewee.SqliteDatabase):
+	"""
+	记录执行的SQL语句数
+	"""
+
+	def __init__(self, *args: Any, **kwargs: Any) -> None:
+		super().__init__(*args, **kwargs)
+		self.queries = 0
+
+	def execute_sql(self, sql: str, params: Any = None, *args: Any, **kwargs: Any) -> Any:
+		self.queries += 1
+		return super().execute_sql(sql, params, *args, **kwargs)
+
+
+def open_database(path: str) -> CountingDatabase:
+	db = CountingDatabase(path)
+	database.initialize(db)
+	db.connect()
+	db.create_tables([Clan_member, Clan_challenge])
+	return db
+
+
+def seed(noise: int = 2000, seed: int = 0, patterns: Tuple[Tuple[str, ...], ...] = BLADE_PATTERNS) -> List[int]:
+	"""
+	写入一天的公会战数据
+
+	:param noise: 其他日期、其他公会、其他期公会战的记录数
+	:param patterns: 成员依次使用的出刀方式
+	:return: 成员的qq号  按成员表的顺序
+	"""
+	rng = random.Random(seed)
+	qqids = [FIRST_QQ + i for i in range(MEMBER_NUM)]
+	Clan_member.insert_many([{'group_id': GROUP_ID, 'qqid': qqid} for qqid in qqids]).execute()
+	Clan_member.insert_many([{'group_id': GROUP_ID + 1, 'qqid': qqid} for qqid in qqids[:5]]).execute()
+	blades: Dict[int, Tuple[str, ...]] = {
+		qqid: patterns[i % len(patterns)] for i, qqid in enumerate(qqids[:MEMBER_NUM - ZERO_BLADE_NUM])
+	}
+	blades[FIRST_QQ - 1] = FORMER_MEMBER_BLADES
+	rows = []
+	# 各成员的出刀交错排列  与实际出刀的先后一样  同一成员内的顺序不变
+	for turn in range(max(len(pattern) for pattern in blades.values())):
+		for qqid, pattern in blades.items():
+			if turn < len(pattern):
+				kind = pattern[turn]
+				rows.append({
+					'bid': BATTLE_ID, 'gid': GROUP_ID, 'qqid': qqid, 'challenge_pcrdate': PCRDATE,
+					'boss_health_remain': 0 if kind == 'e' else rng.randint(1, 6000000), 'is_continue': kind == 'c',
+				})
+	for _ in range(noise):
+		gid, bid, pcrdate = rng.choice((
+			(GROUP_ID, BATTLE_ID, rng.randint(PCRDATE - 5, PCRDATE - 1)),
+			(GROUP_ID, BATTLE_ID - 1, PCRDATE),
+			(GROUP_ID + 1, BATTLE_ID, PCRDATE),
+		))
+		rows.append({
+			'bid': bid, 'gid': gid, 'qqid': rng.choice(qqids), 'challenge_pcrdate': pcrdate,
+			'boss_health_remain': rng.choice((0, 1)), 'is_continue': rng.random() < 0.2,
+		})
+	with database.atomic():
+		for i in range(0, len(rows), 500):
+			Clan_challenge.insert_many(rows[i:i + 500]).execute()
+	return qqids
+
+
+def legacy_record(group_id: int, battle_id: int, date: int, nickname: Callable[[int], str]) -> str:
+	"""
+	改写前 challenge_record 的统计  每个成员查询一次出刀记录  作为对照
+	"""
+	members = Clan_member.select().where(Clan_member.group_id == group_id)
+
+	total_blade_num = 0				#总出刀数
+	total_continue_blade_num = 0	#总补偿刀数量
+	zero_blade_members = []			#一刀没出的成员
+	blade_list = {}
+	for member in members:
+		challenge_records = Clan_challenge.select().where(
+			Clan_challenge.gid == group_id,
+			Clan_challenge.bid == battle_id,
+			Clan_challenge.challenge_pcrdate == date,
+			Clan_challenge.qqid == member.qqid
+		).order_by(Clan_challenge.cid)
+		if len(challenge_records) != 0:
+			member_num = 0			#单个成员出刀数
+			continue_blade_num = 0	#单个成员剩余补偿刀数量
+			for c in challenge_records:
+				if c.boss_health_remain == 0 and not c.is_continue:	#完整刀收尾算0.5刀
+					member_num += 0.5
+					continue_blade_num += 1
+				elif c.is_continue:	#补偿刀算0.5刀
+					member_num += 0.5
+					continue_blade_num -= 1
+				else: member_num += 1
+			total_blade_num += member_num
+			total_continue_blade_num += continue_blade_num
+			if member_num not in blade_list: blade_list[member_num] = 1
+			else: blade_list[member_num] += 1
+		else:
+			zero_blade_members.append(member.qqid)
+
+	back_msg = []
+	back_msg.append(f"待出补偿刀数量：{total_continue_blade_num}")
+	back_msg.append(f"已出0刀的成员数量：{len(zero_blade_members)}")
+	for i in range(len(zero_blade_members)):
+		name = nickname(zero_blade_members[i])
+		back_msg.append(f"{i == len(zero_blade_members)-1 and '┖' or '┣'}{name}")
+	for blade_num in blade_list.keys():
+		back_msg.append(f"已出{blade_num}刀：{blade_list[blade_num]}")
+	back_msg.append(f"今天已出 {total_blade_num}/{len(members)*3}")
+	return '\n'.join(back_msg)
+
+
+def current_record(group_id: int, battle_id: int, date: int, nickname: Callable[[int], str]) -> str:
+	"""
+	与 realize.challenge_record 相同的查询与统计
+	"""
+	members = Clan_member.select().where(Clan_member.group_id == group_id)
+	blades = member_blades(Clan_challenge, group_id, battle_id, date)
+	return record_message([member.qqid for member in members], blades, nickname)
+
+
+def measure(db: CountingDatabase, func: Callable[..., str], repeat: int) -> Tuple[str, int, float]:
+	"""
+	:return: (回复, 每次的查询次数, 每次的平均耗时(秒))
+	"""
+	queries = db.queries
+	result = func(GROUP_ID, BATTLE_ID, PCRDATE, str)
+	queries = db.queries - queries
+	start = time.perf_counter()
+	for _ in range(repeat):
+		func(GROUP_ID, BATTLE_ID, PCRDATE, str)
+	return result, queries, (time.perf_counter() - start) / repeat
+
+
+def main(argv: Any = None) -> int:
+	parser = argparse.ArgumentParser(description="出刀记录查询测试")
+	parser.add_argument("--repeat", type=int, default=200, help="每种实现的重复次数")
+	parser.add_argument("--noise", type=int, default=2000, help="无关的出刀记录数")
+	args = parser.parse_args(argv)
+
+	with tempfile.TemporaryDirectory(prefix="yobot_record_") as root:
+		db = open_database(os.path.join(root, "yobot.db"))
+		try:
+			seed(args.noise)
+			results = {}
+			for name, func in (("legacy", legacy_record), ("current", current_record)):
+				results[name], queries, seconds = measure(db, func, args.repeat)
+				print(f"{name:<8} queries {queries:>3}  {seconds * 1000:8.2f}ms/call")
+		finally:
+			db.close()
+	if results["legacy"] != results["current"]:
+		print("回复不一致")
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,96 @@
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from ...ybdata import Clan_group
+
+_UNSET = object()
+
+
+def _load(text: Optional[str]) -> Dict[str, Any]:
+	# 与 realize.safe_load_json(text, {}) 一致
+	return text and json.loads(text) or {}
+
+
+class GroupState:
+	"""
+	公会当前状态的解析结果
+	挑战中的成员(challenging_member_list)、本周目/下周目boss血量 三个JSON字段各自只在文本变化时重新解析
+	字段由任何地方改写后  下次 sync 时按新文本重新解析  不需要各处手动通知
+
+	返回的字典为共享对象  只读  需要修改时自行解析副本或用 health_copy  改完照旧 json.dumps 写回 group 的字段
+
+	:param challenging: {boss编号: {QQ号: 挑战信息}}
+	:param now_health: {boss编号: 本周目剩余血量}
+	:param next_health: {boss编号: 下周目剩余血量}
+	:param index: {QQ号: (boss编号, 挑战信息)}  查询成员正在挑战哪个王
+	:param tree_boss: 1~5王中第一个有人挂树的王  没有为False
+	"""
+
+	__slots__ = ("_raw", "challenging", "now_health", "next_health", "index", "tree_boss")
+
+	def __init__(self) -> None:
+		self._raw = [_UNSET, _UNSET, _UNSET]
+		self.challenging: Dict[str, Dict[str, Dict[str, Any]]] = {}
+		self.now_health: Dict[str, int] = {}
+		self.next_health: Dict[str, int] = {}
+		self.index: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+		self.tree_boss = False
+
+	def sync(self, group: Clan_group) -> "GroupState":
+		"""
+		与 group 当前的字段对齐  文本未变化的字段不重新解析
+		"""
+		raw = self._raw
+		text = group.challenging_member_list
+		if text is not raw[0] and text != raw[0]:
+			self.challenging = _load(text)
+			self.__build_index()
+			raw[0] = text
+		text = group.now_cycle_boss_health
+		if text is not raw[1] and text != raw[1]:
+			self.now_health = _load(text)
+			raw[1] = text
+		text = group.next_cycle_boss_health
+		if text is not raw[2] and text != raw[2]:
+			self.next_health = _load(text)
+			raw[2] = text
+		return self
+
+	def __build_index(self) -> None:
+		index = {}
+		for boss_num, infos in self.challenging.items():
+			for challenger, info in infos.items():
+				# 同一个人出现在多个王时  与逐个遍历一样取第一个
+				index.setdefault(challenger, (boss_num, info))
+		self.index = index
+		self.tree_boss = False
+		for i in range(1, 6):
+			try:
+				for info in self.challenging[str(i)].values():
+					if info['tree']:
+						self.tree_boss = i
+						break
+			except KeyError:
+				continue
+			if self.tree_boss:
+				break
+
+	def boss_of(self, qqid: Any) -> Optional[str]:
+		"""
+		成员正在挑战的boss编号  未申请出刀为None
+		"""
+		found = self.index.get(str(qqid))
+		return found[0] if found else None
+
+	def entry(self, qqid: Any) -> Optional[Dict[str, Any]]:
+		"""
+		成员的挑战信息(is_continue, behalf, s, damage, tree, msg)  未申请出刀为None
+		"""
+		found = self.index.get(str(qqid))
+		return found[1] if found else None
+
+	def health_copy(self) -> Tuple[Dict[str, int], Dict[str, int]]:
+		"""
+		本周目、下周目血量的副本  值均为整数  浅复制即可
+		"""
+		return dict(self.now_health), dict(self.next_health)
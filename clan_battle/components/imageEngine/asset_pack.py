@@ -0,0 +1,200 @@
+"""
+贴图资源包
+
+将 monster_icon 与 Resource 下的全部PNG预先解码为原始像素  与 data.json 一起打包为单个文件
+运行时以内存映射方式打开  贴图直接由映射的内存创建  不再解码PNG  只有用到的页才会被读入内存
+资源包缺失、版本不符或某张贴图的源文件已被修改时  自动退回解码PNG
+
+生成资源包(更新贴图或 data.json 后需重新生成  本文件不依赖其他模块  可以直接运行):
+    python asset_pack.py
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+
+from PIL import Image
+from typing import Any, Dict, List, Optional, Union
+from pathlib import Path
+
+packRoot = os.path.dirname(os.path.abspath(__file__))
+packPath = os.path.join(packRoot, "sprites.pack")
+dataPath = os.path.join(packRoot, "monster_icon", "data.json")
+SOURCE_DIRS = ("monster_icon", "Resource")
+
+MAGIC = b"YBSPRITE"
+VERSION = 1
+HEADER = struct.Struct("<8sII")  # 魔数  版本  索引长度
+ALIGN = 64
+# 可以直接映射内存的颜色模式  其余模式由原始像素复制一份  仍然不需要解码PNG
+MAPPED_MODES = ("L", "P", "RGBA", "RGBX", "CMYK")
+
+
+def _source_key(stat: os.stat_result) -> List[int]:
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _pack_name(path: Union[str, Path]) -> Optional[str]:
+    """
+    贴图在资源包中的名称  即相对于 imageEngine 目录的路径  不在目录内时为None
+    """
+    name = os.path.relpath(os.path.abspath(path), packRoot)
+    if name.startswith(".."):
+        return None
+    return name.replace(os.sep, "/")
+
+
+def source_files() -> List[str]:
+    files = []
+    for sourceDir in SOURCE_DIRS:
+        for folder, _, names in os.walk(os.path.join(packRoot, sourceDir)):
+            files.extend(os.path.join(folder, name) for name in names if name.lower().endswith(".png"))
+    return sorted(files)
+
+
+def build(path: str = packPath) -> Dict[str, Any]:
+    """
+    生成资源包
+
+    :param path: 输出文件
+    :return: 索引
+    """
+    with open(dataPath, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    sprites: Dict[str, Any] = {}
+    buffers = []
+    offset = 0
+    for sourcePath in source_files():
+        with Image.open(sourcePath) as image:
+            image.load()
+            raw = image.tobytes()
+            entry = {
+                "offset": offset,
+                "length": len(raw),
+                "size": list(image.size),
+                "mode": image.mode,
+                "source": _source_key(os.stat(sourcePath)),
+            }
+            if image.mode == "P":
+                entry["palette"] = image.getpalette()
+                if "transparency" in image.info:
+                    transparency = image.info["transparency"]
+                    entry["transparency"] = list(transparency) if isinstance(transparency, bytes) else transparency
+        monsterId = os.path.splitext(os.path.basename(sourcePath))[0]
+        if monsterId in data and "width" in data[monsterId]:
+            # 贴图的锚点(宽高)  与 data.json 一致
+            entry["anchor"] = [data[monsterId]["width"], data[monsterId]["height"]]
+        sprites[_pack_name(sourcePath)] = entry
+        buffers.append(raw)
+        offset += (len(raw) + ALIGN - 1) // ALIGN * ALIGN
+    index = {
+        "data": data,
+        "dataSource": _source_key(os.stat(dataPath)),
+        "sprites": sprites,
+    }
+    indexBytes = json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    bodyStart = (HEADER.size + len(indexBytes) + ALIGN - 1) // ALIGN * ALIGN
+    tempPath = path + ".tmp"
+    with open(tempPath, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(indexBytes)))
+        file.write(indexBytes)
+        file.write(b"\0" * (bodyStart - HEADER.size - len(indexBytes)))
+        for raw in buffers:
+            file.write(raw)
+            file.write(b"\0" * (-len(raw) % ALIGN))
+    # 替换后  已映射旧文件的进程继续使用旧文件的内容
+    os.replace(tempPath, path)
+    return index
+
+
+class AssetPack:
+    """
+    以内存映射方式读取资源包
+
+    :param path: 资源包文件  不存在或格式不符时所有贴图都退回解码PNG
+    """
+
+    def __init__(self, path: str = packPath) -> None:
+        self.path = path
+        self.__mapped: Optional[mmap.mmap] = None
+        self.__index: Dict[str, Any] = {}
+        self.__bodyStart = 0
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.stale = 0
+        try:
+            with open(path, "rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return
+        try:
+            magic, version, indexLength = HEADER.unpack_from(mapped, 0)
+        except struct.error:
+            magic, version, indexLength = b"", 0, 0
+        if magic != MAGIC or version != VERSION:
+            mapped.close()
+            return
+        self.__index = json.loads(mapped[HEADER.size:HEADER.size + indexLength].decode("utf-8"))
+        self.__bodyStart = (HEADER.size + indexLength + ALIGN - 1) // ALIGN * ALIGN
+        self.__mapped = mapped
+
+    @property
+    def loaded(self) -> bool:
+        return self.__mapped is not None
+
+    def data(self) -> Dict[str, Any]:
+        """
+        monster_icon/data.json 的内容  资源包中的副本过期时重新读取文件
+        """
+        stat = os.stat(dataPath)
+        if self.__mapped is not None and self.__index.get("dataSource") == _source_key(stat):
+            return self.__index["data"]
+        with open(dataPath, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def load(self, path: Union[str, Path], stat: Optional[os.stat_result] = None) -> Optional[Image.Image]:
+        """
+        从资源包中取出贴图
+
+        :param path: 贴图源文件路径
+        :param stat: 源文件的 os.stat 结果  已经获取过时传入可以省去一次系统调用
+        :return: 只读贴图  不在资源包中或源文件已修改时为None
+        """
+        if self.__mapped is None:
+            return None
+        name = _pack_name(path)
+        entry = self.__index["sprites"].get(name) if name is not None else None
+        if entry is None:
+            return None
+        if entry["source"] != _source_key(stat if stat is not None else os.stat(path)):
+            with self.__lock:
+                self.stale += 1
+            return None
+        start = self.__bodyStart + entry["offset"]
+        buffer = memoryview(self.__mapped)[start:start + entry["length"]]
+        mode = entry["mode"]
+        if mode in MAPPED_MODES:
+            image = Image.frombuffer(mode, tuple(entry["size"]), buffer, "raw", mode, 0, 1)
+        else:
+            image = Image.frombytes(mode, tuple(entry["size"]), buffer)
+        if mode == "P":
+            image.putpalette(entry["palette"])
+            if "transparency" in entry:
+                transparency = entry["transparency"]
+                image.info["transparency"] = bytes(transparency) if isinstance(transparency, list) else transparency
+        image.readonly = 1
+        with self.__lock:
+            self.hits += 1
+        return image
+
+    def stats(self) -> Dict[str, int]:
+        return {"sprites": len(self.__index.get("sprites", {})), "hits": self.hits, "stale": self.stale}
+
+
+asset_pack = AssetPack()
+
+
+if __name__ == "__main__":
+    index = build(packPath)
+    print(f"{len(index['sprites'])} sprites -> {packPath} ({os.path.getsize(packPath) / 1024 / 1024:.1f}MB)")
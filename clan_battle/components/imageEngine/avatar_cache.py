@@ -0,0 +1,94 @@
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+from typing import Dict, Optional, Tuple, Union
+from pathlib import Path
+
+from .avatar_store import avatar_store
+from .sprite_registry import readonly_view
+
+
+class AvatarCache:
+    """
+    头像缓存
+    以 (头像文件, 尺寸, 圆角半径) 为键保存缩放并切好圆角的头像  可以直接粘贴
+    头像文件修改时间变化后重新生成  头像缺失时返回透明占位图
+    内存中没有时先查头像变体库  变体库中也没有时解码头像文件  只把用到的这一种变体写入变体库
+    其余变体由头像下载器生成  出图线程不做多余的缩放和写入
+    无法解码的头像按缺失处理  并记住该文件的修改时间  文件被替换前不再重复解码
+    两个出图引擎共用
+
+    :param maxsize: 最多缓存的头像数
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self.__tiles: 'OrderedDict[Tuple[str, int, Optional[int]], Tuple[int, Image.Image]]' = OrderedDict()
+        self.__placeholders: Dict[int, Image.Image] = {}
+        self.__broken: Dict[str, int] = {}
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.broken = 0
+
+    def __placeholder(self, size: int) -> Image.Image:
+        placeholder = self.__placeholders.get(size)
+        if placeholder is None:
+            placeholder = Image.new("RGBA", (size, size), (255, 255, 255, 0))
+            self.__placeholders[size] = placeholder
+        return placeholder
+
+    def tile(self, path: Union[str, Path], size: int = 20, radius: Optional[int] = None) -> Tuple[Image.Image, bool]:
+        """
+        获取头像
+
+        :param path: 头像文件路径
+        :param size: 边长
+        :param radius: 圆角半径  None为整圆
+        :return: (头像的只读视图, 头像文件是否存在且可用)  视图可以随意关闭
+        """
+        key = (str(path), size, radius)
+        try:
+            mtime = os.stat(key[0]).st_mtime_ns
+        except OSError:
+            return readonly_view(self.__placeholder(size)), False
+        with self.__lock:
+            if self.__broken.get(key[0]) == mtime:
+                return readonly_view(self.__placeholder(size)), False
+            cached = self.__tiles.get(key)
+            if cached is not None and cached[0] == mtime:
+                self.__tiles.move_to_end(key)
+                self.hits += 1
+                return readonly_view(cached[1]), True
+        # 解码放在锁外  不同头像可以并行处理
+        try:
+            tile = avatar_store.get(key[0], size, radius, mtime)
+            if tile is None:
+                with Image.open(key[0]) as image:
+                    tile = avatar_store.put(key[0], image, mtime, ((size, radius),))[(size, radius)]
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            with self.__lock:
+                self.broken += 1
+                self.__broken[key[0]] = mtime
+            return readonly_view(self.__placeholder(size)), False
+        with self.__lock:
+            self.__broken.pop(key[0], None)
+            self.misses += 1
+            self.__tiles[key] = (mtime, tile)
+            self.__tiles.move_to_end(key)
+            while len(self.__tiles) > self.maxsize:
+                self.__tiles.popitem(last=False)
+        return readonly_view(tile), True
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__tiles.clear()
+            self.__broken.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self.__tiles), "hits": self.hits, "misses": self.misses, "broken": self.broken}
+
+
+avatar_cache = AvatarCache()
@@ -0,0 +1,364 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+import random
+import ssl
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import httpx
+from PIL import Image
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from .avatar_store import avatar_store
+
+_logger = logging.getLogger(__name__)
+
+AVATAR_URL = "http://q1.qlogo.cn/g?b=qq&nk={qqid}&s=1"
+# 这些状态码说明服务端暂时不可用  值得重试
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# 头像目录下记录各头像的校验信息(ETag、Last-Modified、上次检查时间)和连续失败次数
+META_NAME = "avatar_meta.json"
+
+
+def _valid_image(path: Path) -> bool:
+    """
+    完整解码一次  截断或不是图片的文件不接受
+    """
+    try:
+        with Image.open(path) as image:
+            image.load()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return False
+    return True
+
+
+def _remove(path: Path) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _accept(body: bytes, temp_path: Path, image_path: Path) -> bool:
+    """
+    写入临时文件  校验通过后替换原头像并生成变体
+    写文件、解码、SQLite写入都会阻塞  在线程池中调用
+
+    :return: 是否为完整的图片  不是时不替换原头像
+    """
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(body)
+        if not _valid_image(temp_path):
+            _remove(temp_path)
+            return False
+        # 同一文件系统内的重命名是原子的  出图时读到的要么是旧头像要么是新头像
+        os.replace(temp_path, image_path)
+    except OSError:
+        _remove(temp_path)
+        raise
+    # 同时生成出图用的各尺寸变体  出图时不再解码JPEG
+    avatar_store.build(image_path)
+    return True
+
+
+def _read_json(path: Path) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temp_path, path)
+    except OSError as e:
+        _remove(temp_path)
+        _logger.warning(f"头像校验信息保存失败 {e}")
+
+
+class _HostLimiter:
+    """
+    按主机限速  同一主机的请求之间至少间隔 1/rate 秒
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.__next: Dict[str, float] = {}
+
+    async def wait(self, host: str) -> None:
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        start = max(now, self.__next.get(host, now))
+        # 先占好时间片再等待  并发的请求依次排开
+        self.__next[host] = start + 1 / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class AvatarDownloader:
+    """
+    头像下载器
+    所有下载共用一个保持连接的httpx客户端  同时下载数、每个主机每秒请求数均有上限  失败后按指数退避重试
+    两个出图引擎共用
+    先写入临时文件  完整解码校验通过后再替换原头像  下载失败不会留下残缺的头像
+    已有的头像超过 ttl 后才重新检查  带上 If-None-Match / If-Modified-Since  未修改时不再传输
+    失败的QQ号记入头像目录下的 avatar_meta.json  按连续失败次数指数退避  退避期间不再请求  重启后仍然有效
+
+    :param url: 头像地址模板  {qqid} 替换为QQ号  可以改为本地的替身服务器
+    :param concurrency: 同时下载的头像数  也是连接池的大小
+    :param rate: 每个主机每秒最多发起的请求数  0为不限
+    :param retries: 失败后的重试次数
+    :param backoff: 第一次重试前等待的秒数  之后每次翻倍
+    :param timeout: 单次请求的超时时间(秒)
+    :param proxies: 代理地址
+    :param ttl: 已有头像多少秒后重新检查是否更新
+    :param failure_backoff: 第一次失败后多少秒内不再请求  之后每次失败翻倍
+    :param max_failure_backoff: 失败退避的上限(秒)
+    """
+
+    def __init__(self, url: str = AVATAR_URL, concurrency: int = 8, rate: float = 20, retries: int = 2,
+                 backoff: float = 0.5, timeout: float = 15, proxies: Optional[str] = None,
+                 ttl: float = 86400, failure_backoff: float = 60, max_failure_backoff: float = 86400) -> None:
+        self.url = url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.proxies = proxies
+        self.ttl = ttl
+        self.failure_backoff = failure_backoff
+        self.max_failure_backoff = max_failure_backoff
+        self.__limiter = _HostLimiter(rate)
+        self.__client: Optional[httpx.AsyncClient] = None
+        self.__ssl_context: Optional[ssl.SSLContext] = None
+        self.__semaphore: Optional[asyncio.Semaphore] = None
+        self.__meta: Dict[Path, Dict[str, Dict[str, Any]]] = {}
+        self.downloaded = 0
+        self.not_modified = 0
+        self.invalid = 0
+        self.failed = 0
+        self.retried = 0
+        self.skipped = 0
+
+    def configure(self, url: Optional[str] = None, concurrency: Optional[int] = None, rate: Optional[float] = None,
+                  retries: Optional[int] = None, backoff: Optional[float] = None, timeout: Optional[float] = None,
+                  proxies: Optional[str] = None, ttl: Optional[float] = None, failure_backoff: Optional[float] = None,
+                  max_failure_backoff: Optional[float] = None) -> None:
+        """
+        修改配置  客户端在下次下载时按新配置重建
+        """
+        if url is not None: self.url = url
+        if concurrency is not None: self.concurrency = concurrency
+        if rate is not None: self.__limiter = _HostLimiter(rate)
+        if retries is not None: self.retries = retries
+        if backoff is not None: self.backoff = backoff
+        if timeout is not None: self.timeout = timeout
+        if proxies is not None: self.proxies = proxies
+        if ttl is not None: self.ttl = ttl
+        if failure_backoff is not None: self.failure_backoff = failure_backoff
+        if max_failure_backoff is not None: self.max_failure_backoff = max_failure_backoff
+        client, self.__client, self.__semaphore = self.__client, None, None
+        if client is not None:
+            asyncio.ensure_future(client.aclose())
+
+    def __new_client(self, proxies: Optional[str], shared: bool = False) -> httpx.AsyncClient:
+        # 第一次新建客户端时要导入 httpcore 等模块并读取证书文件  耗时上百毫秒  由 __open_client 放到线程池中进行
+        # 证书上下文只创建一次  之后的客户端共用
+        if self.__ssl_context is None and hasattr(httpx, "create_ssl_context"):
+            self.__ssl_context = httpx.create_ssl_context()
+        kwargs = {"timeout": self.timeout}
+        if self.__ssl_context is not None:
+            kwargs["verify"] = self.__ssl_context
+        if shared:
+            kwargs["limits"] = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        if proxies is not None:
+            # httpx 0.26 起 proxies 参数改名为 proxy
+            kwargs["proxy" if "proxy" in inspect.signature(httpx.AsyncClient.__init__).parameters else "proxies"] = proxies
+        return httpx.AsyncClient(**kwargs)
+
+    async def __open_client(self, proxies: Optional[str] = None) -> httpx.AsyncClient:
+        """
+        在线程池中新建客户端
+
+        :param proxies: 只对本次下载使用的代理  为None时返回共用的客户端
+        """
+        loop = asyncio.get_event_loop()
+        if proxies is not None:
+            return await loop.run_in_executor(None, self.__new_client, proxies)
+        if self.__client is None:
+            client = await loop.run_in_executor(None, self.__new_client, self.proxies, True)
+            if self.__client is None:
+                self.__client = client
+            else:
+                # 同时有多个下载在等待新建时只保留先建好的一个
+                await client.aclose()
+        return self.__client
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self.__client is None:
+            self.__client = self.__new_client(self.proxies, True)
+        return self.__client
+
+    async def fetch(self, url: str, image_path: Path, proxies: Optional[str] = None,
+                    entry: Optional[Dict[str, Any]] = None) -> Optional[Path]:
+        """
+        下载一张图片
+
+        :param url: 图片地址
+        :param image_path: 保存路径
+        :param proxies: 只对本次下载使用的代理  为None时使用共用的客户端
+        :param entry: 该图片的校验信息  有则发送条件请求  成功后更新为新的 ETag / Last-Modified
+        :return: 保存路径(未修改时为原文件)  失败时为None
+        """
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.__semaphore:
+            if proxies is None:
+                return await self.__fetch(await self.__open_client(), url, image_path, entry)
+            async with await self.__open_client(proxies) as client:
+                return await self.__fetch(client, url, image_path, entry)
+
+    async def __fetch(self, client: httpx.AsyncClient, url: str, image_path: Path,
+                      entry: Optional[Dict[str, Any]]) -> Optional[Path]:
+        host = urlsplit(url).netloc
+        headers = {}
+        # 只有文件还在时才能接受 304
+        if entry and image_path.exists():
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("modified"):
+                headers["If-Modified-Since"] = entry["modified"]
+        temp_path = image_path.with_name(f"{image_path.name}.{os.getpid()}.tmp")
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                # 指数退避  加上随机抖动  避免重试的请求同时到达
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * (1 + random.random() / 2))
+            await self.__limiter.wait(host)
+            try:
+                async with client.stream(method="GET", url=url, headers=headers) as response:
+                    if response.status_code != 200:
+                        # 读完响应体  连接才能放回连接池复用
+                        await response.aread()
+                    if response.status_code in RETRY_STATUS:
+                        continue
+                    if response.status_code == 304 and headers:
+                        self.not_modified += 1
+                        return image_path
+                    if response.status_code != 200:
+                        break
+                    # 头像只有几KB  读入内存后交给线程池写入和校验  不阻塞事件循环
+                    body = await response.aread()
+                    if not await asyncio.get_event_loop().run_in_executor(None, _accept, body, temp_path, image_path):
+                        # 可能是传输中途出错  按失败重试
+                        self.invalid += 1
+                        continue
+                    if entry is not None:
+                        entry["etag"] = response.headers.get("ETag")
+                        entry["modified"] = response.headers.get("Last-Modified")
+            except (httpx.TransportError, OSError):
+                continue
+            self.downloaded += 1
+            return image_path
+        self.failed += 1
+        return None
+
+    async def __meta_load(self, folder: Path) -> Dict[str, Dict[str, Any]]:
+        meta = self.__meta.get(folder)
+        if meta is None:
+            meta = await asyncio.get_event_loop().run_in_executor(None, _read_json, folder.joinpath(META_NAME))
+            # 读取期间其他下载可能已经载入
+            meta = self.__meta.setdefault(folder, meta)
+        return meta
+
+    async def __meta_save(self, folder: Path) -> None:
+        # 在事件循环中序列化  避免写入时其他下载正在修改
+        text = json.dumps(self.__meta[folder], separators=(",", ":"))
+        await asyncio.get_event_loop().run_in_executor(None, _write_atomic, folder.joinpath(META_NAME), text)
+
+    async def download(self, user_id_list: Iterable[int], folder: Union[str, Path], refresh: bool = False) -> List[Optional[Path]]:
+        """
+        下载用户头像  保存为 <folder>/<QQ号>.jpg  重复的QQ号只下载一次
+        近 ttl 秒内检查过的头像直接跳过  失败退避中的QQ号不发起请求
+
+        :param refresh: 忽略 ttl  已有的头像全部重新检查(仍然是条件请求)
+        :return: 各头像的保存路径  失败或退避中的为None
+        """
+        folder = Path(folder)
+        user_ids = list(dict.fromkeys(user_id_list))
+        meta = await self.__meta_load(folder)
+        now = time.time()
+        result: List[Optional[Path]] = [None] * len(user_ids)
+        tasks = []
+        pending = []
+        for i, user_id in enumerate(user_ids):
+            name = f"{user_id}.jpg"
+            image_path = folder.joinpath(name)
+            entry = meta.get(name, {})
+            if entry.get("retry", 0) > now:
+                self.skipped += 1
+                continue
+            # 没有校验记录的旧头像可能是残缺的  当作缺失重新下载
+            if not refresh and now - entry.get("checked", -self.ttl) < self.ttl and image_path.exists():
+                result[i] = image_path
+                continue
+            meta[name] = entry
+            pending.append((i, entry))
+            tasks.append(self.fetch(self.url.format(qqid=user_id), image_path, entry=entry))
+        if not tasks:
+            return result
+        fetched = await asyncio.gather(*tasks)
+        now = time.time()
+        failed = 0
+        for (i, entry), image_path in zip(pending, fetched):
+            result[i] = image_path
+            if image_path is not None:
+                entry["checked"] = now
+                entry.pop("failures", None)
+                entry.pop("retry", None)
+            else:
+                failed += 1
+                entry["failures"] = entry.get("failures", 0) + 1
+                entry["retry"] = now + min(self.failure_backoff * 2 ** (entry["failures"] - 1), self.max_failure_backoff)
+        await self.__meta_save(folder)
+        if failed:
+            _logger.warning(f"头像下载失败 {failed}/{len(tasks)}")
+        return result
+
+    async def refresh(self, folder: Union[str, Path]) -> List[Optional[Path]]:
+        """
+        检查目录下已有的头像  超过 ttl 的发送条件请求  有更新时替换
+        """
+        folder = Path(folder)
+        user_ids = [int(path.stem) for path in folder.glob("*.jpg") if path.stem.isdigit()]
+        return await self.download(user_ids, folder)
+
+    async def aclose(self) -> None:
+        client, self.__client = self.__client, None
+        if client is not None:
+            await client.aclose()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "downloaded": self.downloaded,
+            "not_modified": self.not_modified,
+            "invalid": self.invalid,
+            "failed": self.failed,
+            "retried": self.retried,
+            "skipped": self.skipped,
+        }
+
+
+avatar_downloader = AvatarDownloader()
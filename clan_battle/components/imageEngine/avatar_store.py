@@ -0,0 +1,190 @@
+"""
+头像变体库
+
+下载头像时预先生成缩放并切好圆角的RGBA变体  以原始像素存入头像目录下的单个SQLite文件
+出图时按 (QQ号, 尺寸, 圆角半径) 直接查出  不再逐个打开JPEG解码缩放
+数据库以内存映射方式读取  各线程使用各自的连接
+头像JPEG仍然保留  作为条件请求的依据和变体的来源  变体记录了来源文件的修改时间  不一致时视为过期
+"""
+import os
+import sqlite3
+import threading
+
+from PIL import Image
+from typing import Dict, Optional, Tuple, Union
+from pathlib import Path
+
+from .corner_mask import round_corner
+
+STORE_NAME = "avatar_variants.db"
+# 下载时生成的变体 (尺寸, 圆角半径)  None为整圆
+# 20整圆: 旧版出图的成员标签  20圆角10: 新版出图的头像标签  40整圆: 留给更大的面板
+VARIANTS: Tuple[Tuple[int, Optional[int]], ...] = ((20, None), (20, 10), (40, None))
+MMAP_SIZE = 64 * 1024 * 1024
+# 变体像素的格式版本  生成方式改变时加一  旧版本的库整表重建
+# 2: 圆角外侧恢复为与透明白色合成
+STORE_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS avatar_variant (
+    qqid INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    radius INTEGER NOT NULL,
+    source_mtime INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    pixels BLOB NOT NULL,
+    PRIMARY KEY (qqid, size, radius)
+) WITHOUT ROWID
+"""
+
+
+def make_variant(image: Image.Image, size: int, radius: Optional[int]) -> Image.Image:
+    """
+    生成一个变体  与 avatar_cache 解码JPEG后的处理完全一致
+    """
+    return round_corner(image.resize((size, size)), radius)
+
+
+class AvatarStore:
+    """
+    头像变体库  每个头像目录一个数据库文件
+    两个出图引擎和头像下载器共用
+    """
+
+    def __init__(self) -> None:
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__ready: Dict[str, bool] = {}
+        self.hits = 0
+        self.stale = 0
+        self.stored = 0
+
+    def __connect(self, folder: Path) -> Optional[sqlite3.Connection]:
+        connections = getattr(self.__local, "connections", None)
+        if connections is None:
+            connections = self.__local.connections = {}
+        path = str(folder.joinpath(STORE_NAME))
+        connection = connections.get(path)
+        if connection is None:
+            try:
+                connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+                connection.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                with self.__lock:
+                    if not self.__ready.get(path):
+                        # WAL模式下读写互不阻塞  出图线程读取时下载器可以同时写入
+                        connection.execute("PRAGMA journal_mode=WAL")
+                        if connection.execute("PRAGMA user_version").fetchone()[0] != STORE_VERSION:
+                            connection.execute("DROP TABLE IF EXISTS avatar_variant")
+                            connection.execute(f"PRAGMA user_version={STORE_VERSION}")
+                        connection.execute(_SCHEMA)
+                        self.__ready[path] = True
+            except sqlite3.Error:
+                return None
+            connections[path] = connection
+        return connection
+
+    def __discard(self, folder: Path) -> None:
+        """
+        关闭本线程的连接  下次使用时重新连接
+        """
+        connection = self.__local.connections.pop(str(folder.joinpath(STORE_NAME)), None)
+        if connection is not None:
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
+
+    def get(self, path: Union[str, Path], size: int, radius: Optional[int], mtime: int) -> Optional[Image.Image]:
+        """
+        查询变体
+
+        :param path: 头像文件路径  <头像目录>/<QQ号>.jpg
+        :param size: 边长
+        :param radius: 圆角半径  None为整圆
+        :param mtime: 头像文件当前的 st_mtime_ns  与生成变体时不同则视为过期
+        :return: 变体  不存在或已过期时为None
+        """
+        path = Path(path)
+        if not path.stem.isdigit():
+            return None
+        connection = self.__connect(path.parent)
+        if connection is None:
+            return None
+        try:
+            row = connection.execute(
+                "SELECT source_mtime, mode, pixels FROM avatar_variant WHERE qqid=? AND size=? AND radius=?",
+                (int(path.stem), size, -1 if radius is None else radius),
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        if row[0] != mtime:
+            with self.__lock:
+                self.stale += 1
+            return None
+        with self.__lock:
+            self.hits += 1
+        return Image.frombytes(row[1], (size, size), row[2])
+
+    def put(self, path: Union[str, Path], image: Image.Image, mtime: int,
+            variants: Tuple[Tuple[int, Optional[int]], ...] = VARIANTS) -> Dict[Tuple[int, Optional[int]], Image.Image]:
+        """
+        由头像原图生成变体并写入
+
+        :param path: 头像文件路径
+        :param image: 已打开的头像原图
+        :param mtime: 头像文件的 st_mtime_ns
+        :param variants: 要生成的 (尺寸, 圆角半径)
+        :return: {(尺寸, 圆角半径): 变体}
+        """
+        path = Path(path)
+        tiles = {variant: make_variant(image, *variant) for variant in variants}
+        if not path.stem.isdigit():
+            return tiles
+        connection = self.__connect(path.parent)
+        if connection is None:
+            return tiles
+        try:
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO avatar_variant VALUES (?, ?, ?, ?, ?, ?)",
+                    [(int(path.stem), size, -1 if radius is None else radius, mtime, tile.mode, tile.tobytes())
+                     for (size, radius), tile in tiles.items()],
+                )
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                # 写入或提交失败(如等锁超时)时回滚  连接不能留在未结束的事务中
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            if connection.in_transaction:
+                # 回滚也失败时放弃这个连接
+                self.__discard(path.parent)
+            return tiles
+        with self.__lock:
+            self.stored += len(tiles)
+        return tiles
+
+    def build(self, path: Union[str, Path]) -> bool:
+        """
+        为头像文件生成全部变体  下载完成后在下载器的工作线程中调用
+
+        :return: 是否成功
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with Image.open(path) as image:
+                self.put(path, image, mtime)
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            return False
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "stale": self.stale, "stored": self.stored}
+
+
+avatar_store = AvatarStore()
@@ -0,0 +1,150 @@
+import os
+import sys
+import threading
+
+from PIL import Image
+from typing import Dict, List, Tuple
+from pathlib import Path
+
+from .sprite_registry import sprite_registry
+
+texturePath = os.path.join(os.path.dirname(__file__), "Resource")
+backgroundCachePath = Path.cwd().resolve().joinpath("./yobot_data/image_cache/background") if "_MEIPASS" in dir(sys) else Path(__file__).parent.parent.parent.parent.parent.joinpath("./yobot_data/image_cache/background")
+
+BACKGROUND_SIZE = (2048, 1536)
+OVERLAY_TILE = (64, 32)
+
+
+class OverlayLayer:
+    """
+    预处理后的全画幅覆盖层
+    按 OVERLAY_TILE 切块  全透明的块直接丢弃  完全不透明的块用paste直接覆盖  其余块才做alpha_composite
+    同一行相邻的同类块会合并  结果与对整张图alpha_composite完全一致
+
+    :param image: 覆盖层原图 (RGBA)
+    """
+
+    def __init__(self, image: Image.Image) -> None:
+        self.size = image.size
+        self.opaqueTiles: List[Tuple[Image.Image, Tuple[int, int]]] = []
+        self.blendTiles: List[Tuple[Image.Image, Tuple[int, int]]] = []
+        alpha = image.getchannel("A")
+        for top in range(0, image.height, OVERLAY_TILE[1]):
+            bottom = min(top + OVERLAY_TILE[1], image.height)
+            runStart = 0
+            runType = None
+            for left in range(0, image.width + OVERLAY_TILE[0], OVERLAY_TILE[0]):
+                if left < image.width:
+                    extrema = alpha.crop((left, top, min(left + OVERLAY_TILE[0], image.width), bottom)).getextrema()
+                    tileType = "empty" if extrema[1] == 0 else "opaque" if extrema[0] == 255 else "blend"
+                else:
+                    tileType = None
+                if tileType == runType:
+                    continue
+                if runType is not None and runType != "empty":
+                    box = (runStart, top, min(left, image.width), bottom)
+                    if runType == "blend":
+                        # 混合块再裁掉四周的透明区域
+                        bbox = alpha.crop(box).getbbox()
+                        box = (box[0] + bbox[0], box[1] + bbox[1], box[0] + bbox[2], box[1] + bbox[3])
+                        self.blendTiles.append((image.crop(box), box[:2]))
+                    else:
+                        self.opaqueTiles.append((image.crop(box), box[:2]))
+                runStart = left
+                runType = tileType
+        alpha.close()
+
+    def apply(self, target: Image.Image) -> None:
+        """
+        将覆盖层叠加到目标画布上  效果等同于 target.alpha_composite(image, (0, 0))
+
+        :param target: 目标画布  尺寸须与覆盖层一致
+        """
+        for tile, dest in self.blendTiles:
+            target.alpha_composite(tile, dest)
+        for tile, dest in self.opaqueTiles:
+            target.paste(tile, dest)
+
+
+class BackgroundLibrary:
+    """
+    场景背景库
+    每个背景只缩放一次  缩放结果以原始像素格式保存在 yobot_data/image_cache/background 下  重启后直接读取
+    背景原图修改后(修改时间变化)会重新生成
+    """
+
+    def __init__(self, size: Tuple[int, int] = BACKGROUND_SIZE) -> None:
+        self.size = size
+        self.__backgrounds: Dict[int, Tuple[int, Image.Image]] = {}
+        self.__overlays: Dict[str, Tuple[int, OverlayLayer]] = {}
+        self.__lock = threading.Lock()
+
+    def __cache_file(self, backgroundId: int, mtime: int) -> Path:
+        return backgroundCachePath.joinpath(f"{backgroundId}_{self.size[0]}x{self.size[1]}_{mtime}.rgba")
+
+    def __prepare(self, backgroundId: int, mtime: int) -> Image.Image:
+        cacheFile = self.__cache_file(backgroundId, mtime)
+        if cacheFile.is_file() and cacheFile.stat().st_size == self.size[0] * self.size[1] * 4:
+            return Image.frombytes("RGBA", self.size, cacheFile.read_bytes())
+        background = sprite_registry.template(os.path.join(texturePath, "background", f"{backgroundId}.png"))
+        background = background.convert("RGBA").resize(self.size)
+        try:
+            backgroundCachePath.mkdir(parents=True, exist_ok=True)
+            for staleFile in backgroundCachePath.glob(f"{backgroundId}_{self.size[0]}x{self.size[1]}_*.rgba"):
+                staleFile.unlink()
+            tempFile = cacheFile.with_suffix(".tmp")
+            tempFile.write_bytes(background.tobytes())
+            os.replace(tempFile, cacheFile)
+        except OSError:
+            # 缓存写不进去也不影响出图  下次启动再缩放一次而已
+            pass
+        return background
+
+    def background(self, backgroundId: int) -> Image.Image:
+        """
+        获取缩放好的背景模板  调用者不可修改  需要作为画布时请使用 canvas()
+
+        :param backgroundId: 背景编号  对应 Resource/background/<编号>.png
+        :return: RGBA背景模板
+        """
+        mtime = os.stat(os.path.join(texturePath, "background", f"{backgroundId}.png")).st_mtime_ns
+        cached = self.__backgrounds.get(backgroundId)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with self.__lock:
+            cached = self.__backgrounds.get(backgroundId)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, self.__prepare(backgroundId, mtime))
+                self.__backgrounds[backgroundId] = cached
+        return cached[1]
+
+    def canvas(self, backgroundId: int) -> Image.Image:
+        """
+        以背景为底创建一张新画布
+
+        :param backgroundId: 背景编号
+        :return: 可写的RGBA画布
+        """
+        return self.background(backgroundId).copy()
+
+    def overlay(self, name: str = "clanBattle.png") -> OverlayLayer:
+        """
+        获取预处理后的覆盖层
+
+        :param name: Resource下的覆盖层文件名
+        :return: 覆盖层
+        """
+        path = os.path.join(texturePath, name)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.__overlays.get(name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with self.__lock:
+            cached = self.__overlays.get(name)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, OverlayLayer(sprite_registry.template(path)))
+                self.__overlays[name] = cached
+        return cached[1]
+
+
+background_library = BackgroundLibrary()
@@ -0,0 +1,447 @@
+"""
+出图性能测试
+
+使用随机生成的公会状态  覆盖 data.json 中的全部boss  0~30人挑战  挂树/预约组合  超长id  已击破的boss
+头像和boss头像使用临时生成的占位图  不需要联网
+头像、boss头像、背景缩放缓存、图片库的目录在运行期间都指向临时目录  结束后恢复  不会改动 yobot_data
+除耗时外还统计每次出图新建图片的字节数与存活图片字节数的峰值  并比较 incremental / pooled 两种出图模式多线程并发时的峰值
+另外对出图中常见尺寸的圆角单独计时  与改写前每次重新生成遮罩的实现对照
+
+用法:
+    python -m clan_battle.components.imageEngine.benchmark --output result.json
+    python -m clan_battle.components.imageEngine.benchmark --baseline result.json
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import PIL
+from PIL import Image, ImageDraw
+
+from . import background_library, imageEngine
+from .canvas_pool import canvas_pool
+from .corner_mask import round_corner
+from .frame_composer import frame_cache
+from .. import image_engine
+from ..image_store import image_store
+from ..output_encoder import encode_cq_image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MODES = ("incremental", "pooled")
+CHALLENGER_COUNTS = (0, 1, 3, 8, 15, 30)
+NICKNAME_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789公会战测试昵称补代挂树预约"
+AVATAR_NUM = 64
+FIRST_QQ = 100000
+# (名称, 宽, 高, 圆角半径)  出图中实际用到的尺寸  None为两端半圆
+CORNER_CASES = (
+    ("avatar_20x20_r10", 20, 20, 10),
+    ("chip_120x24_r12", 120, 24, 12),
+    ("hp_bar_218x20_r10", 218, 20, 10),
+    ("boss_icon_65x65_r10", 65, 65, 10),
+    ("legacy_hp_315x24_pill", 315, 24, None),
+    ("legacy_panel_420x300_r5", 420, 300, 5),
+)
+
+
+def peak_rss() -> Optional[int]:
+    """
+    进程的峰值常驻内存(字节)  无法获取时为None
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 的单位是字节  Linux 是KB
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class Recorder:
+    """
+    记录各阶段的耗时、新建图片的像素字节数及存活图片字节数的峰值
+    统计图片字节数时临时替换 Image.Image._new  所有新建图片(含Pillow内部运算产生的)都会被计入
+    图片对象被回收时从存活字节数中扣除  阶段内的峰值减去阶段开始时的存活字节数即为该阶段的内存峰值
+    """
+
+    def __init__(self) -> None:
+        self.times: Dict[str, List[float]] = {}
+        self.imageBytes: Dict[str, int] = {}
+        self.peakBytes: Dict[str, int] = {}
+        self.allocated = 0
+        self.live = 0
+        self.peak = 0
+        self.__lock = threading.Lock()
+        self.__originalNew = None
+
+    def allocate(self, size: int) -> None:
+        with self.__lock:
+            self.allocated += size
+            self.live += size
+            self.peak = max(self.peak, self.live)
+
+    def free(self, size: int) -> None:
+        with self.__lock:
+            self.live -= size
+
+    def __enter__(self) -> "Recorder":
+        recorder = self
+        originalNew = Image.Image._new
+        self.__originalNew = originalNew
+
+        def counting_new(image: Image.Image, im: Any) -> Image.Image:
+            # 新版Pillow将像素数据保存在 _im 中
+            if im is image.__dict__.get("_im", image.__dict__.get("im")):
+                # 共享像素数据的只读视图  没有分配新内存
+                return originalNew(image, im)
+            bytesPerPixel = 1 if im.mode in ("1", "L", "P") else 4
+            size = im.size[0] * im.size[1] * bytesPerPixel
+            recorder.allocate(size)
+            result = originalNew(image, im)
+            weakref.finalize(result, recorder.free, size)
+            return result
+
+        Image.Image._new = counting_new
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        Image.Image._new = self.__originalNew
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        with self.__lock:
+            allocated = self.allocated
+            live = self.peak = self.live
+        start = time.perf_counter()
+        yield
+        self.times.setdefault(name, []).append(time.perf_counter() - start)
+        self.imageBytes[name] = self.imageBytes.get(name, 0) + self.allocated - allocated
+        self.peakBytes[name] = max(self.peakBytes.get(name, 0), self.peak - live)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for name, times in self.times.items():
+            ordered = sorted(times)
+            result[name] = {
+                "count": len(times),
+                "total": sum(times),
+                "mean": sum(times) / len(times),
+                "median": ordered[len(ordered) // 2],
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+                "image_bytes_per_call": self.imageBytes[name] / len(times),
+                "peak_image_bytes": self.peakBytes[name],
+            }
+        return result
+
+
+@contextmanager
+def prepare_assets(root: Path) -> Iterator[None]:
+    """
+    生成占位头像与boss头像  并让两个出图引擎从临时目录读取
+    出图过程中会写入的目录(背景缩放缓存、头像变体库、图片库)也都指向临时目录  退出时恢复原来的目录
+    """
+    avatarPath = root / "user_profile"
+    bossIconPath = root / "boss_icon"
+    avatarPath.mkdir()
+    bossIconPath.mkdir()
+    colorRandom = random.Random(0)
+    for i in range(AVATAR_NUM):
+        color = tuple(colorRandom.randrange(256) for _ in range(3))
+        Image.new("RGB", (100, 100), color).save(avatarPath / f"{FIRST_QQ + i}.jpg")
+    for monsterId in monster_ids():
+        Image.new("RGB", (128, 128), (monsterId // 20 % 256, monsterId % 256, 128)).save(bossIconPath / f"{monsterId}.webp")
+    redirects = (
+        (imageEngine, "headPicturePath", avatarPath),
+        (imageEngine, "bossPath", bossIconPath),
+        (image_engine, "USER_HEADERS_PATH", avatarPath),
+        (image_engine, "BOSS_ICON_PATH", bossIconPath),
+        (background_library, "backgroundCachePath", root / "image_cache" / "background"),
+        (image_store, "root", root / "image_cache" / "rendered"),
+    )
+    previous = [(target, name, getattr(target, name)) for target, name, _ in redirects]
+    for target, name, path in redirects:
+        setattr(target, name, path)
+    try:
+        yield
+    finally:
+        for target, name, path in previous:
+            setattr(target, name, path)
+
+
+def monster_ids() -> List[int]:
+    return sorted(int(key) for key in imageEngine.data if key.isdigit())
+
+
+def lineups() -> List[Tuple[int, ...]]:
+    """
+    组合出若干套阵容  保证 data.json 中的每个boss至少出现一次
+    """
+    byPosition: Dict[int, List[int]] = {}
+    for monsterId in monster_ids():
+        byPosition.setdefault(monsterId // 1000, []).append(monsterId)
+    count = max(len(ids) for ids in byPosition.values())
+    return [tuple(byPosition[position][i % len(byPosition[position])] for position in range(1, 6)) for i in range(count)]
+
+
+def nickname(rng: random.Random, long: bool) -> str:
+    length = rng.randint(20, 40) if long else rng.randint(1, 10)
+    return "".join(rng.choice(NICKNAME_CHARS) for _ in range(length))
+
+
+def synthetic_state(rng: random.Random, lineup: Tuple[int, ...]) -> Dict[str, Any]:
+    """
+    生成一个公会状态  格式与 realize.challenger_info 传给出图引擎的数据一致
+    """
+    groupBossData = {}
+    extraInfoList = []
+    bossCycle = rng.randint(1, 60)
+    for bossNum, monsterId in enumerate(lineup, 1):
+        fullHealth = rng.choice((6000000, 8000000, 12000000, 27000000))
+        dead = rng.random() < 0.2
+        groupBossData[bossNum] = {
+            "cycle": bossCycle + (1 if dead else 0),
+            "health": 0 if dead else rng.randint(1, fullHealth),
+            "full_health": fullHealth,
+            "icon_id": str(monsterId),
+            "name": imageEngine.data[str(monsterId)]["cnName"],
+        }
+        longNames = rng.random() < 0.3
+        members = rng.sample(range(FIRST_QQ, FIRST_QQ + AVATAR_NUM + 16), rng.choice(CHALLENGER_COUNTS))
+        extraInfo: Dict[str, Dict[str, str]] = {"预约": {}, "挑战": {}}
+        for qq in members:
+            extraInfo["挑战"][str(qq)] = nickname(rng, longNames) + ("(补)" if rng.random() < 0.3 else "")
+        if members and rng.random() < 0.5:
+            extraInfo["挂树"] = {str(qq): nickname(rng, longNames) for qq in members[:rng.randint(1, len(members))]}
+        for qq in rng.sample(range(FIRST_QQ, FIRST_QQ + AVATAR_NUM + 16), rng.randint(0, 10)):
+            extraInfo["预约"][str(qq)] = nickname(rng, longNames) + (":" + nickname(rng, False) if rng.random() < 0.5 else "")
+        extraInfoList.append(extraInfo)
+    clanInfo = {
+        "finishChallengeCount": rng.randint(0, 90),
+        "halfChallengeCount": rng.randint(0, 30),
+        "levelCycle": rng.randint(0, 4),
+        "bossCycle": bossCycle,
+        "clanRank": rng.randint(0, 3000),
+        "selfRank": rng.randint(0, 3000),
+    }
+    return {"groupBossData": groupBossData, "extraInfoList": extraInfoList, "clanInfo": clanInfo}
+
+
+def run_state(recorder: Recorder, state: Dict[str, Any], groupId: int) -> None:
+    groupBossData = state["groupBossData"]
+    extraInfoList = state["extraInfoList"]
+    clanInfo = state["clanInfo"]
+
+    for bossNum in range(1, 6):
+        thisBossData = groupBossData[bossNum]
+        with recorder.stage("monster_icon_generate"):
+            imageEngine.monster_icon_generate(thisBossData["icon_id"], thisBossData["health"],
+                                              thisBossData["full_health"], thisBossData["cycle"]).close()
+
+    panels = []
+    for bossNum in range(1, 6):
+        with recorder.stage("boss_statue_draw"):
+            panels.append(imageEngine.boss_statue_draw(groupBossData[bossNum]["icon_id"], extraInfoList[bossNum - 1]))
+
+    with recorder.stage("state_image_generate"):
+        resultImage = imageEngine.state_image_generate(groupBossData, panels, clanInfo)
+
+    with recorder.stage("encode_jpeg"):
+        resultImage.convert("RGB").save(BytesIO(), format="JPEG", quality=95)
+    resultImage.close()
+
+    # 增量出图  先出一次完整的帧  再只改变一个boss的血量
+    imageEngine.state_image_update(groupId, groupBossData, extraInfoList, clanInfo)
+    changed = dict(groupBossData)
+    changed[1] = dict(groupBossData[1], health=max(groupBossData[1]["health"] - 1, 0))
+    with recorder.stage("state_image_update_one_boss"):
+        imageEngine.state_image_update(groupId, changed, extraInfoList, clanInfo)
+
+    cores = [
+        image_engine.BossStatusImageCore(
+            groupBossData[bossNum]["cycle"],
+            groupBossData[bossNum]["health"],
+            groupBossData[bossNum]["full_health"],
+            groupBossData[bossNum]["name"],
+            groupBossData[bossNum]["icon_id"],
+            extraInfoList[bossNum - 1],
+            False,
+        )
+        for bossNum in range(1, 6)
+    ]
+    with recorder.stage("legacy_generate_combind_boss_state_image"):
+        image_engine.generate_combind_boss_state_image(cores).close()
+
+    # 两种出图模式的完整流程(出图 + 编码)  incremental 每个群保留的上一帧也计入峰值
+    for mode in MODES:
+        with recorder.stage("render_" + mode):
+            render_mode(mode, state, -groupId)
+
+
+def render_mode(mode: str, state: Dict[str, Any], groupId: int) -> None:
+    """
+    按指定模式出图并编码  与 render_service.render_state_image 的流程一致
+    """
+    if mode == "pooled":
+        with imageEngine.state_image_canvas(state["groupBossData"], state["extraInfoList"], state["clanInfo"]) as resultImage:
+            encode_cq_image(resultImage)
+        return
+    with canvas_pool.slot():
+        resultImage = imageEngine.state_image_update(groupId, state["groupBossData"], state["extraInfoList"], state["clanInfo"])
+        encode_cq_image(resultImage)
+    resultImage.close()
+
+
+def run_concurrent(recorder: Recorder, mode: str, stateList: List[Dict[str, Any]], concurrency: int) -> None:
+    """
+    以 concurrency 个线程并发为各个群出图  模拟多个群同时查询状态
+    """
+    frame_cache.invalidate()
+    canvas_pool.configure(concurrency)
+    with recorder.stage(f"concurrent_{mode}"):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda item: render_mode(mode, item[1], item[0]), enumerate(stateList, 1)))
+
+
+def legacy_round_corner(image: Image.Image, radius: Optional[int] = None) -> Image.Image:
+    """
+    改写前的圆角实现  每次重新绘制遮罩并整张合成  作为对照
+    """
+    size = image.height if radius is None else radius * 2
+    circleBg = Image.new("L", (size * 5, size * 5), 0)
+    ImageDraw.Draw(circleBg).ellipse((0, 0, size * 5, size * 5), 255)
+    circleBg = circleBg.resize((size, size))
+    mask = Image.new("L", image.size, 255)
+    if radius is None:
+        splitX = round(circleBg.size[0] / 2)
+        mask.paste(circleBg.crop((0, 0, splitX, size)), (0, 0))
+        mask.paste(circleBg.crop((splitX, 0, size, size)), (image.width - (size - splitX), 0))
+    else:
+        mask.paste(circleBg.crop((0, 0, radius, radius)), (0, 0))
+        mask.paste(circleBg.crop((radius, 0, radius * 2, radius)), (image.width - radius, 0))
+        mask.paste(circleBg.crop((0, radius, radius, radius * 2)), (0, image.height - radius))
+        mask.paste(circleBg.crop((radius, radius, radius * 2, radius * 2)), (image.width - radius, image.height - radius))
+    maskPasteBg = Image.new("RGBA", image.size, (255, 255, 255, 0))
+    result = Image.composite(image, maskPasteBg, mask)
+    circleBg.close()
+    maskPasteBg.close()
+    mask.close()
+    image.close()
+    return result
+
+
+def run_round_corner(recorder: Recorder, repeat: int) -> None:
+    """
+    圆角单独计时  每个尺寸分别记录改写前(legacy)和当前实现  输入图片的复制不计入
+    """
+    for name, width, height, radius in CORNER_CASES:
+        source = Image.effect_noise((width, height), 60).convert("RGBA")
+        for stage, func in ((f"round_corner_{name}_legacy", legacy_round_corner), (f"round_corner_{name}", round_corner)):
+            for _ in range(repeat):
+                image = source.copy()
+                with recorder.stage(stage):
+                    image = func(image, radius)
+                image.close()
+        source.close()
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> bool:
+    """
+    与基准结果比较各阶段的中位耗时
+
+    :return: 是否没有超出容差的退化
+    """
+    passed = True
+    print(f"{'stage':<44}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, stats in result["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            print(f"{name:<44}{'-':>12}{stats['median'] * 1000:>10.2f}ms{'new':>8}")
+            continue
+        ratio = stats["median"] / base["median"] if base["median"] else float("inf")
+        flag = "" if ratio <= 1 + tolerance else "  <-- regression"
+        if flag:
+            passed = False
+        print(f"{name:<44}{base['median'] * 1000:>10.2f}ms{stats['median'] * 1000:>10.2f}ms{ratio:>8.2f}{flag}")
+    return passed
+
+
+def run(states: int, seed: int, warmup: int, concurrency: int, cornerRepeat: int = 200) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    allLineups = lineups()
+    # 每套阵容至少一个状态  保证所有boss都被覆盖
+    stateList = [synthetic_state(rng, allLineups[i % len(allLineups)]) for i in range(max(states, len(allLineups)))]
+    for state in stateList[:warmup]:
+        run_state(Recorder(), state, 0)
+
+    statsBefore = Image.core.get_stats() if hasattr(Image.core, "get_stats") else {}
+    with Recorder() as recorder:
+        for groupId, state in enumerate(stateList, 1):
+            run_state(recorder, state, groupId)
+        if concurrency:
+            for mode in MODES:
+                run_concurrent(recorder, mode, stateList, concurrency)
+        if cornerRepeat:
+            run_round_corner(recorder, cornerRepeat)
+    statsAfter = Image.core.get_stats() if hasattr(Image.core, "get_stats") else {}
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+        },
+        "parameters": {"states": len(stateList), "seed": seed, "warmup": warmup, "concurrency": concurrency,
+                       "corner_repeat": cornerRepeat},
+        "monster_ids": monster_ids(),
+        "stages": recorder.summary(),
+        "peak_rss": peak_rss(),
+        "pillow_arena": {key: statsAfter[key] - statsBefore.get(key, 0) for key in statsAfter if isinstance(statsAfter[key], int)},
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="出图性能测试")
+    parser.add_argument("--states", type=int, default=20, help="随机生成的公会状态数  至少为阵容数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warmup", type=int, default=2, help="预热用的状态数  不计入结果")
+    parser.add_argument("--output", type=Path, help="结果写入的JSON文件")
+    parser.add_argument("--baseline", type=Path, help="用于比较的基准结果JSON文件")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="中位耗时允许的退化比例")
+    parser.add_argument("--concurrency", type=int, default=4, help="比较出图模式时并发出图的线程数  0为不比较")
+    parser.add_argument("--corner-repeat", type=int, default=200, help="每个尺寸的圆角单独计时的次数  0为不计时")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="yobot_benchmark_") as root:
+        with prepare_assets(Path(root)):
+            result = run(args.states, args.seed, args.warmup, args.concurrency, args.corner_repeat)
+
+    for name, stats in result["stages"].items():
+        print(f"{name:<44}median {stats['median'] * 1000:8.2f}ms  p95 {stats['p95'] * 1000:8.2f}ms  "
+              f"images {stats['image_bytes_per_call'] / 1024 / 1024:8.2f}MB/call  peak {stats['peak_image_bytes'] / 1024 / 1024:8.2f}MB  x{stats['count']}")
+    if result["peak_rss"] is not None:
+        print(f"peak RSS {result['peak_rss'] / 1024 / 1024:.1f}MB")
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if not compare(result, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import threading
+from contextlib import contextmanager
+
+from PIL import Image
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+
+class PooledFrame(NamedTuple):
+    """
+    画布池借出的一帧
+
+    canvas: RGBA画布  合成时使用  部分绘制操作依赖透明度  不能直接画在RGB上
+    output: 同尺寸的RGB图  合成完成后把画布粘贴进来  代替 convert("RGB") 交给JPEG编码
+    """
+    canvas: Image.Image
+    output: Image.Image
+
+
+class CanvasPool:
+    """
+    可复用的画布池  并限制同时出图的帧数
+    低内存模式下状态图直接画在池中的画布上  编码完成后归还  之后的出图不再新建整幅画布
+    池中保留的帧数不超过 maxFrames  每帧约21MB(RGBA画布 + RGB输出)
+
+    :param maxFrames: 同时出图的最大帧数  超出时等待其他帧完成
+    """
+
+    def __init__(self, maxFrames: int = 2) -> None:
+        self.maxFrames = maxFrames
+        self.__semaphore = threading.BoundedSemaphore(maxFrames)
+        self.__free: Dict[Tuple[int, int], List[PooledFrame]] = {}
+        self.__lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def configure(self, maxFrames: int) -> None:
+        """
+        修改同时出图的最大帧数  正在出图的帧不受影响
+        """
+        with self.__lock:
+            self.maxFrames = maxFrames
+            self.__semaphore = threading.BoundedSemaphore(maxFrames)
+            self.__free.clear()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """
+        占用一个出图名额  with块结束后归还
+        """
+        semaphore = self.__semaphore
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    @contextmanager
+    def frame(self, size: Tuple[int, int]) -> Iterator[PooledFrame]:
+        """
+        占用一个出图名额并借出一帧  内容为上次使用后的残留  须整幅覆盖后再使用
+
+        :param size: 画布尺寸
+        :return: with块结束后归还  之后不可再引用
+        """
+        with self.slot():
+            with self.__lock:
+                free = self.__free.get(size)
+                frame = free.pop() if free else None
+            if frame is None:
+                frame = PooledFrame(canvas=Image.new("RGBA", size), output=Image.new("RGB", size))
+                self.created += 1
+            else:
+                self.reused += 1
+            try:
+                yield frame
+            finally:
+                with self.__lock:
+                    if sum(len(frames) for frames in self.__free.values()) < self.maxFrames:
+                        self.__free.setdefault(size, []).append(frame)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__free.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"free": sum(len(frames) for frames in self.__free.values()), "created": self.created, "reused": self.reused}
+
+
+canvas_pool = CanvasPool()
@@ -0,0 +1,94 @@
+from functools import lru_cache
+
+from PIL import Image, ImageDraw
+from typing import Optional, Tuple
+
+WHOLE_MASK_AREA = 128 * 128
+
+
+@lru_cache(maxsize=256)
+def corner_mask_tiles(width: int, height: int, radius: Optional[int] = None) -> Tuple[Tuple[Tuple[int, int, int, int], Image.Image], ...]:
+    """
+    生成并缓存圆角遮罩
+    只保存四个角(radius为None时为左右两个半圆)需要处理的区域  其余部分遮罩恒为255  无需处理
+
+    :param width: 图片宽度
+    :param height: 图片高度
+    :param radius: 圆角半径  None为左右两端半圆
+    :return: ((区域, 该区域的遮罩), ...)  返回的遮罩为共享对象  不可修改
+    """
+    if radius is None:
+        size = height
+    else:
+        size = radius * 2
+
+    circle_bg = Image.new("L", (size * 5, size * 5), 0)
+    circle_draw = ImageDraw.Draw(circle_bg)
+    circle_draw.ellipse((0, 0, size * 5, size * 5), 255)
+    circle_bg = circle_bg.resize((size, size))
+
+    mask = Image.new("L", (width, height), 255)
+    if radius is None:
+        circle_split_cursor_x = round(circle_bg.size[0] / 2)
+        right_width = size - circle_split_cursor_x
+        mask.paste(circle_bg.crop((0, 0, circle_split_cursor_x, size)), (0, 0))
+        mask.paste(circle_bg.crop((circle_split_cursor_x, 0, size, size)), (width - right_width, 0))
+        boxes = [(0, 0, circle_split_cursor_x, height), (width - right_width, 0, width, height)]
+        overlap = width < size
+    else:
+        mask.paste(circle_bg.crop((0, 0, radius, radius)), (0, 0))
+        mask.paste(circle_bg.crop((radius, 0, radius * 2, radius)), (width - radius, 0))
+        mask.paste(circle_bg.crop((0, radius, radius, radius * 2)), (0, height - radius))
+        mask.paste(circle_bg.crop((radius, radius, radius * 2, radius * 2)), (width - radius, height - radius))
+        boxes = [
+            (0, 0, radius, radius),
+            (width - radius, 0, width, radius),
+            (0, height - radius, radius, height),
+            (width - radius, height - radius, width, height),
+        ]
+        overlap = width < size or height < size
+    circle_bg.close()
+
+    if overlap or width * height <= WHOLE_MASK_AREA:
+        # 四个角互相重叠时只能整张处理  小图整张处理比分块处理调用次数更少  反而更快
+        boxes = [(0, 0, width, height)]
+    boxes = [(max(box[0], 0), max(box[1], 0), min(box[2], width), min(box[3], height)) for box in boxes]
+    tiles = tuple((box, mask.crop(box)) for box in boxes if box[0] < box[2] and box[1] < box[3])
+    mask.close()
+    return tiles
+
+
+@lru_cache(maxsize=256)
+def _blank_tile(width: int, height: int) -> Image.Image:
+    """
+    圆角外侧的底色  透明白色  与改写前整张合成时的底图一致  共享对象  不可修改
+    """
+    return Image.new("RGBA", (width, height), (255, 255, 255, 0))
+
+
+def round_corner(image: Image.Image, radius: Optional[int] = None) -> Image.Image:
+    """
+    为图片添加圆角
+    只在四个角的小块区域上用缓存的遮罩与透明白色底合成  再贴回原图  其余部分不变
+    边缘半透明像素的RGB与改写前整张 Image.composite 的结果逐像素相同
+    非RGBA图片会先转换为RGBA  此时原图会被关闭
+
+    :param image: 原图
+    :param radius: 圆角半径  None为左右两端半圆
+    :return: 添加圆角后的图片  RGBA图片时即为原图本身
+    """
+    if image.mode != "RGBA":
+        converted = image.convert("RGBA")
+        image.close()
+        image = converted
+    for box, mask in corner_mask_tiles(image.width, image.height, radius):
+        blank = _blank_tile(mask.width, mask.height)
+        if box == (0, 0, image.width, image.height):
+            result = Image.composite(image, blank, mask)
+        else:
+            tile = image.crop(box)
+            result = Image.composite(tile, blank, mask)
+            tile.close()
+        image.paste(result, box[:2])
+        result.close()
+    return image
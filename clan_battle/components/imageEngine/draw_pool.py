@@ -0,0 +1,69 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Callable, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+class DrawPool:
+    """
+    并行绘制互不依赖的组件(各boss的信息栏、Monster图标等)
+    Pillow的缩放、合成、模糊等操作会释放GIL  多个组件可以在多个核上同时绘制
+    结果按传入顺序返回  调用方按原顺序合成  与串行绘制结果一致
+    所有出图线程共用一个有界线程池  同时绘制的组件数不超过 workers
+
+    :param workers: 线程数  1为串行绘制
+    """
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.workers = workers if workers is not None else min(4, os.cpu_count() or 1)
+        self.__executor: Optional[ThreadPoolExecutor] = None
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    def configure(self, workers: int) -> None:
+        """
+        修改线程数  已创建的线程池在下次使用时按新配置重建
+        """
+        with self.__lock:
+            self.workers = workers
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def __executor_get(self) -> ThreadPoolExecutor:
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="clan_battle_draw",
+                                                     initializer=self.__mark_worker)
+            return self.__executor
+
+    def __mark_worker(self) -> None:
+        self.__local.worker = True
+
+    def map(self, funcs: Sequence[Callable[[], T]]) -> List[T]:
+        """
+        并行执行绘制函数
+
+        :param funcs: 无参数的绘制函数  彼此之间不能有依赖
+        :return: 按传入顺序排列的结果  任一函数出错时在全部完成后抛出第一个错误
+        """
+        # 线程池内部再次调用时直接串行  避免互相等待占满线程池
+        if self.workers <= 1 or len(funcs) <= 1 or getattr(self.__local, "worker", False):
+            return [func() for func in funcs]
+        executor = self.__executor_get()
+        futures = [executor.submit(func) for func in funcs[1:]]
+        # 第一个组件由调用线程自己绘制  减少一次线程切换
+        try:
+            first = funcs[0]()
+        finally:
+            errors = [future.exception() for future in futures]
+        error = next((e for e in errors if e is not None), None)
+        if error is not None:
+            raise error
+        return [first] + [future.result() for future in futures]
+
+
+draw_pool = DrawPool()
@@ -0,0 +1,77 @@
+import threading
+
+from PIL import ImageFont
+from typing import Dict, Tuple
+
+
+class FontRegistry:
+    """
+    进程级字体缓存
+    以 (字体文件, 字号) 为键  每种字体只解析一次  多线程安全
+
+    truetype() 每次都会重新读取并解析字体文件  msyh.ttf 这类中文字体有好几MB  渲染一次状态图要解析几十次
+    """
+
+    def __init__(self) -> None:
+        self.__fonts: Dict[Tuple[str, int], ImageFont.FreeTypeFont] = {}
+        self.__lock = threading.Lock()
+        self.__load_count: Dict[Tuple[str, int], int] = {}
+        self.__hit_count: Dict[Tuple[str, int], int] = {}
+
+    def get(self, font_file: str, size: int) -> ImageFont.FreeTypeFont:
+        """
+        获取字体  未加载过的字体会在此时加载
+        加载失败时抛出的OSError不会被缓存  下次调用会重新尝试
+
+        :param font_file: 字体文件路径
+        :param size: 字号
+        :return: 可共享的字体对象  请勿修改
+        """
+        key = (str(font_file), size)
+        font = self.__fonts.get(key)
+        if font is None:
+            with self.__lock:
+                font = self.__fonts.get(key)
+                if font is None:
+                    font = ImageFont.truetype(key[0], size=size)
+                    self.__fonts[key] = font
+                    self.__load_count[key] = self.__load_count.get(key, 0) + 1
+                    return font
+        with self.__lock:
+            self.__hit_count[key] = self.__hit_count.get(key, 0) + 1
+        return font
+
+    def clear(self) -> None:
+        """
+        清空已加载的字体  统计数据保留  之后的调用会重新加载字体
+        """
+        with self.__lock:
+            self.__fonts.clear()
+
+    @property
+    def load_count(self) -> int:
+        return sum(self.__load_count.values())
+
+    @property
+    def hit_count(self) -> int:
+        return sum(self.__hit_count.values())
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        获取各字体的加载及命中次数
+
+        :return: {"字体文件名:字号": {"load": 加载次数, "hit": 命中次数}}
+        """
+        with self.__lock:
+            keys = set(self.__load_count) | set(self.__hit_count)
+            return {
+                f"{key[0]}:{key[1]}": {"load": self.__load_count.get(key, 0), "hit": self.__hit_count.get(key, 0)}
+                for key in sorted(keys)
+            }
+
+
+font_registry = FontRegistry()
+
+
+def get_font(font_file: str, size: int) -> ImageFont.FreeTypeFont:
+    return font_registry.get(font_file, size)
@@ -0,0 +1,208 @@
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from .sprite_registry import readonly_view
+from .timing import timed
+from .draw_pool import draw_pool
+
+# 绘制方式
+PASTE = "paste"  # 直接覆盖  resultImage.paste(image, xy)
+MASK = "mask"  # 以自身为遮罩粘贴  resultImage.paste(image, xy, mask=image)
+COMPOSITE = "composite"  # resultImage.alpha_composite(image, xy)
+
+Box = Tuple[int, int, int, int]
+
+
+class DrawOp(NamedTuple):
+    image: Image.Image
+    position: Tuple[int, int]
+    mode: str
+
+    @property
+    def box(self) -> Box:
+        return (self.position[0], self.position[1], self.position[0] + self.image.width, self.position[1] + self.image.height)
+
+
+class Layer(NamedTuple):
+    """
+    画面中的一个区域
+
+    name: 区域名  如 boss1 / panel1 / cycle
+    key: 生成该区域的全部输入  与上一帧相同(==)时直接沿用上一帧的结果
+    draw: 生成该区域的绘制操作  只在输入变化时调用
+    """
+    name: str
+    key: Any
+    draw: Callable[[], List[DrawOp]]
+
+
+def apply_op(target: Image.Image, op: DrawOp, origin: Tuple[int, int] = (0, 0)) -> None:
+    """
+    执行一次绘制操作
+
+    :param target: 目标图片
+    :param op: 绘制操作
+    :param origin: 目标图片左上角在整幅画面中的坐标  局部重绘时使用
+    """
+    x = op.position[0] - origin[0]
+    y = op.position[1] - origin[1]
+    if op.mode == PASTE:
+        target.paste(op.image, (x, y))
+    elif op.mode == MASK:
+        target.paste(op.image, (x, y), mask=op.image)
+    else:
+        # alpha_composite 不接受负坐标  越界部分改为裁剪源图
+        target.alpha_composite(op.image, (max(x, 0), max(y, 0)), (max(-x, 0), max(-y, 0)))
+
+
+def _intersects(a: Box, b: Box) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _merge_boxes(boxes: List[Box]) -> List[Box]:
+    # 相交的脏区域合并为一个  避免同一块像素重绘多次
+    merged: List[Box] = []
+    for box in boxes:
+        while True:
+            for other in merged:
+                if _intersects(box, other):
+                    merged.remove(other)
+                    box = (min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3]))
+                    break
+            else:
+                break
+        merged.append(box)
+    return merged
+
+
+class Frame(NamedTuple):
+    background: Image.Image
+    layers: Tuple[Tuple[str, Any, Tuple[DrawOp, ...]], ...]
+    image: Image.Image
+
+
+@timed()
+def compose(background: Image.Image, layers: List[Layer]) -> Frame:
+    """
+    按顺序绘制全部区域  生成完整的一帧
+    各区域的组件并行绘制  再按原顺序合成
+    """
+    image = background.copy()
+    drawn = []
+    for layer, ops in zip(layers, draw_pool.map([lambda layer=layer: tuple(layer.draw()) for layer in layers])):
+        for op in ops:
+            apply_op(image, op)
+        drawn.append((layer.name, layer.key, ops))
+    return Frame(background=background, layers=tuple(drawn), image=image)
+
+
+@timed()
+def compose_into(canvas: Image.Image, background: Image.Image, layers: List[Layer]) -> Image.Image:
+    """
+    在给定的画布上绘制全部区域  结果与 compose 一致  但不新建整幅画布
+
+    :param canvas: RGBA画布  尺寸须与背景一致  原有内容会被背景覆盖
+    :param background: 背景模板  不会被修改
+    :return: canvas
+    """
+    canvas.paste(background, (0, 0))
+    for ops in draw_pool.map([lambda layer=layer: tuple(layer.draw()) for layer in layers]):
+        for op in ops:
+            apply_op(canvas, op)
+    return canvas
+
+
+@timed("compose_update")
+def update(previous: Frame, background: Image.Image, layers: List[Layer]) -> Frame:
+    """
+    在上一帧的基础上只重绘输入发生变化的区域
+    脏区域由变化区域新旧两次绘制范围的并集确定  脏区域内以背景为底按原顺序重放所有相交的绘制操作  结果与完整重绘一致
+
+    :param previous: 上一帧  区域划分须与本次相同
+    """
+    drawn = []
+    dirty: List[Box] = []
+    changed = [layer for layer, (_, key, _) in zip(layers, previous.layers) if layer.key != key]
+    # 变化的区域并行绘制
+    changedOps = iter(draw_pool.map([lambda layer=layer: tuple(layer.draw()) for layer in changed]))
+    for layer, (name, key, ops) in zip(layers, previous.layers):
+        if layer.key == key:
+            drawn.append((name, key, ops))
+            continue
+        newOps = next(changedOps)
+        dirty.extend(op.box for op in ops)
+        dirty.extend(op.box for op in newOps)
+        drawn.append((name, layer.key, newOps))
+    if not dirty:
+        return Frame(background=background, layers=tuple(drawn), image=previous.image)
+
+    image = previous.image.copy()
+    for box in _merge_boxes(dirty):
+        box = (max(box[0], 0), max(box[1], 0), min(box[2], image.width), min(box[3], image.height))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            continue
+        region = background.crop(box)
+        for _, _, ops in drawn:
+            for op in ops:
+                if _intersects(op.box, box):
+                    apply_op(region, op, box[:2])
+        image.paste(region, box[:2])
+        region.close()
+    return Frame(background=background, layers=tuple(drawn), image=image)
+
+
+class FrameCache:
+    """
+    各群最近一帧画面的缓存
+    记录每个区域由哪些输入生成  下次出图时只重绘输入变化了的区域
+
+    :param max_groups: 最多缓存的群数  每帧约12MB  超出后淘汰最久未出图的群
+    """
+
+    def __init__(self, max_groups: int = 16) -> None:
+        self.max_groups = max_groups
+        self.__frames: 'OrderedDict[Any, Frame]' = OrderedDict()
+        self.__lock = threading.Lock()
+        self.full_count = 0
+        self.partial_count = 0
+
+    def render(self, groupId: Any, background: Image.Image, layers: List[Layer]) -> Image.Image:
+        """
+        生成画面
+
+        :param groupId: 群号
+        :param background: 背景模板  不会被修改
+        :param layers: 按绘制顺序排列的区域
+        :return: 画面的只读视图  写入时自动复制
+        """
+        with self.__lock:
+            previous = self.__frames.get(groupId)
+        if previous is not None and previous.background is background \
+                and [name for name, _, _ in previous.layers] == [layer.name for layer in layers]:
+            frame = update(previous, background, layers)
+            self.partial_count += 1
+        else:
+            frame = compose(background, layers)
+            self.full_count += 1
+        with self.__lock:
+            self.__frames[groupId] = frame
+            self.__frames.move_to_end(groupId)
+            while len(self.__frames) > self.max_groups:
+                self.__frames.popitem(last=False)
+        return readonly_view(frame.image)
+
+    def invalidate(self, groupId: Optional[Any] = None) -> None:
+        with self.__lock:
+            if groupId is None:
+                self.__frames.clear()
+            else:
+                self.__frames.pop(groupId, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"groups": len(self.__frames), "full": self.full_count, "partial": self.partial_count}
+
+
+frame_cache = FrameCache()
@@ -0,0 +1,125 @@
+import os
+import threading
+
+from PIL import Image
+from typing import Dict, NamedTuple, Tuple
+
+from .sprite_registry import sprite_registry, readonly_view
+
+monsterIconPath = os.path.join(os.path.dirname(__file__), "monster_icon")
+texturePath = os.path.join(os.path.dirname(__file__), "Resource")
+
+
+class MonsterSprite(NamedTuple):
+    """
+    boss与舞台合成好的静态贴图及其锚点
+
+    image: 合成好的模板  不可修改
+    axisOffset: boss贴图在画布中的横向偏移
+    stagePosition: 舞台左上角在画布中的坐标  血条以此定位
+    anchor: boss阴影中心在画布中的坐标  周目条以此定位
+    """
+    image: Image.Image
+    axisOffset: int
+    stagePosition: Tuple[int, int]
+    anchor: Tuple[int, int]
+
+
+def _compose(monsterId: str, alive: bool, icon: Image.Image, stage: Image.Image, box: Image.Image, geometry: dict) -> MonsterSprite:
+    # icon背景生成，宽度须分为4种情况
+    # monster图片宽度小于stage宽度
+    # monster图片中心左侧宽度小于stage中心左侧宽度
+    # monster图片中心右侧宽度小于stage中心右侧宽度
+    # monster图片宽度大于stage宽度
+    leftCompare = geometry[monsterId]["width"] - geometry["stage"]["width"]
+    rightCompare = (icon.width - geometry[monsterId]["width"]) - (stage.width - geometry["stage"]["width"])
+    bgHeight = geometry[monsterId]["height"] + stage.height - geometry["stage"]["height"]
+
+    # 图片粘贴时坐标补偿
+    if leftCompare < 0:
+        axisOffset = abs(leftCompare)
+    else:
+        axisOffset = 0
+
+    if icon.width < stage.width:
+        if rightCompare < 0:
+            bossState = Image.new("RGBA", (stage.width, bgHeight), (0, 0, 0, 0))
+        else:
+            bossState = Image.new("RGBA", (stage.width + rightCompare, bgHeight), (0, 0, 0, 0))
+    elif leftCompare < 0:
+        bossState = Image.new("RGBA", (icon.width - leftCompare, bgHeight), (0, 0, 0, 0))
+    elif rightCompare < 0:
+        bossState = Image.new("RGBA", (icon.width - rightCompare, bgHeight), (0, 0, 0, 0))
+    else:
+        bossState = Image.new("RGBA", (icon.width, bgHeight), (0, 0, 0, 0))
+
+    bossState.paste(stage, (leftCompare + axisOffset, bgHeight - stage.height), mask=stage)
+
+    if not alive:
+        if leftCompare < 0:
+            bossState.alpha_composite(box, (72, bossState.height - box.height - 78))  # 暂未考虑到box高度小于boss高度的情况
+        else:
+            bossState.alpha_composite(box, (72 + leftCompare, bossState.height - box.height - 78))
+    else:
+        bossState.alpha_composite(icon, (axisOffset, 0))
+
+    return MonsterSprite(image=bossState,
+                         axisOffset=axisOffset,
+                         stagePosition=(leftCompare + axisOffset, bgHeight - stage.height),
+                         anchor=(geometry[monsterId]["width"] + axisOffset, geometry[monsterId]["height"]))
+
+
+class MonsterSpriteCache:
+    """
+    boss静态贴图缓存
+    以 (boss编号, 是否存活) 为键  保存boss+舞台(或宝箱+舞台)的合成结果  每次出图只需要再画血条和周目条
+    任一素材被贴图缓存重新解码(文件被修改)后对应的合成结果会重新生成
+    """
+
+    def __init__(self) -> None:
+        self.__sprites: Dict[Tuple[str, bool], Tuple[Tuple[Image.Image, ...], MonsterSprite]] = {}
+        self.__lock = threading.Lock()
+        self.compose_count = 0
+
+    def get(self, monsterId: str, alive: bool, geometry: dict) -> MonsterSprite:
+        """
+        获取boss静态贴图
+
+        :param monsterId: boss编号
+        :param alive: boss是否存活  已击破的boss显示宝箱
+        :param geometry: monster_icon/data.json 中的贴图锚点数据
+        :return: 静态贴图及锚点  贴图为共享模板  不可修改
+        """
+        sources = (
+            sprite_registry.template(os.path.join(monsterIconPath, monsterId + ".png")),
+            sprite_registry.template(os.path.join(texturePath, "stage.png")),
+            sprite_registry.template(os.path.join(texturePath, "box.png")),
+        )
+        key = (monsterId, alive)
+        cached = self.__sprites.get(key)
+        if cached is not None and all(a is b for a, b in zip(cached[0], sources)):
+            return cached[1]
+        with self.__lock:
+            cached = self.__sprites.get(key)
+            if cached is None or not all(a is b for a, b in zip(cached[0], sources)):
+                cached = (sources, _compose(monsterId, alive, *sources, geometry))
+                self.__sprites[key] = cached
+                self.compose_count += 1
+        return cached[1]
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__sprites.clear()
+
+
+monster_sprite_cache = MonsterSpriteCache()
+
+
+def monster_sprite_view(monsterId: str, alive: bool, geometry: dict) -> Tuple[Image.Image, MonsterSprite]:
+    """
+    获取boss静态贴图的只读视图  在视图上继续绘制时会自动复制
+
+    :return: (视图, 锚点信息)
+    """
+    sprite = monster_sprite_cache.get(monsterId, alive, geometry)
+    return readonly_view(sprite.image), sprite
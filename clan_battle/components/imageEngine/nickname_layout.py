@@ -0,0 +1,125 @@
+import os
+from functools import lru_cache
+
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from .font_registry import get_font
+
+fontPath = os.path.join(os.path.dirname(__file__), "Resource", "tqxyt.ttf")
+
+ICON_LEFT_START = 145
+ICON_TOP_START = 8
+ICON_OFFSET = 30 + 2
+ICON_GAP = 10
+ICON_IGNORE_OFFSET = 9
+NONE_ID_ICON = 24
+INFORMATION_WIDTH = 359
+MAX_SLICE = 8
+
+
+@lru_cache(maxsize=8192)
+def text_width(text: str, size: int = 17) -> int:
+    """
+    文字宽度  同一字符串只测量一次
+    """
+    fontBox = get_font(fontPath, size).getbbox(text)
+    return fontBox[2] - fontBox[0]
+
+
+def display_name(name: str, sliceNum: int) -> str:
+    """
+    按最大显示字符数截断id  截断时末尾加..  为0时不显示id
+    """
+    if not sliceNum:
+        return ""
+    if len(name) > sliceNum:
+        return name[:sliceNum] + ".."
+    return name
+
+
+@lru_cache(maxsize=4096)
+def slice_widths(name: str) -> Tuple[int, ...]:
+    """
+    id按 0~MAX_SLICE 个字符截断后  预估头像图标的宽度(与原迭代算法一致  比实际宽2像素)
+    """
+    return (NONE_ID_ICON,) + tuple(text_width(display_name(name, sliceNum)) + ICON_OFFSET for sliceNum in range(1, MAX_SLICE + 1))
+
+
+def _fits(widths: Sequence[Tuple[int, ...]], sliceNum: int, max_row: int) -> bool:
+    # 每行计算长度,超过行数认为id过长
+    rowNum = 1
+    idWidth = 0
+    for width in widths:
+        iconWidth = width[sliceNum]
+        idWidth += iconWidth + ICON_GAP
+        if idWidth > INFORMATION_WIDTH:
+            rowNum += 1
+            if not sliceNum:
+                idWidth = NONE_ID_ICON + ICON_GAP
+            else:
+                idWidth = iconWidth
+            if rowNum > max_row:
+                return False
+    return True
+
+
+def nickname_slice(names: Sequence[str], max_row: int) -> int:
+    """
+    在不超过max_row行的前提下  求id的最大显示字符数
+    每个id的各截断宽度只测量一次  之后与原迭代算法一样从 MAX_SLICE 到0逐个尝试  不再调用字体
+    截断后加上的..可能比被截掉的字符更宽  宽度不随截断长度单调变化  不能二分查找
+
+    :param names: 按显示顺序排列的id
+    :param max_row: 最多行数
+    :return: 最大显示字符数  0为不显示id
+    """
+    widths = [slice_widths(name) for name in names]
+    for sliceNum in range(MAX_SLICE, 0, -1):
+        if _fits(widths, sliceNum, max_row):
+            return sliceNum
+    return 0
+
+
+class PanelPlan(NamedTuple):
+    """
+    信息栏的排版结果
+
+    icons: ((qq号, 显示的id, 头像图标左上角坐标), ...)
+    overflow: 放不下时 ... 的坐标  全部放得下时为None
+    """
+    icons: Tuple[Tuple[str, str, Tuple[int, int]], ...]
+    overflow: Optional[Tuple[int, int]]
+
+
+def icon_width(text: str) -> int:
+    """
+    head_picture_draw 生成的头像图标宽度
+    """
+    return (30 if text else 24) + text_width(text)
+
+
+def plan_panel(members: Sequence[Tuple[str, str]], sliceNum: int, iconTopStart: int, max_row: int) -> PanelPlan:
+    """
+    排版一种状态的成员头像  绘制时直接使用结果  不再测量文字
+
+    :param members: ((qq号, id), ...)
+    :param sliceNum: id的最大显示字符数
+    :param iconTopStart: 第一行头像的纵坐标
+    :param max_row: 最多行数
+    """
+    icons: List[Tuple[str, str, Tuple[int, int]]] = []
+    rowNum = 0
+    informationPosX = ICON_LEFT_START
+    informationPosY = iconTopStart
+    for qqNum, name in members:
+        text = display_name(name, sliceNum)
+        width = icon_width(text)
+        if informationPosX + width > ICON_LEFT_START + INFORMATION_WIDTH:
+            rowNum += 1
+            if rowNum >= max_row:
+                return PanelPlan(icons=tuple(icons), overflow=(informationPosX, informationPosY + ICON_IGNORE_OFFSET))
+            informationPosX = ICON_LEFT_START
+            informationPosY += NONE_ID_ICON + ICON_TOP_START
+        icons.append((qqNum, text, (informationPosX, informationPosY)))
+        informationPosX += width + ICON_GAP
+    return PanelPlan(icons=tuple(icons), overflow=None)
@@ -0,0 +1,133 @@
+import math
+from functools import lru_cache
+
+from PIL import Image, ImageChops, ImageDraw
+from typing import Optional, Tuple
+
+from .font_registry import get_font
+
+# (x偏移, y偏移, 横向次数, 纵向次数)  等价于在 (x偏移 + i, y偏移 + j) 处各画一次文字  i < 横向次数  j < 纵向次数
+Spread = Tuple[int, int, int, int]
+
+_measureDraw = ImageDraw.Draw(Image.new("L", (1, 1)))
+
+
+def _shift(image: Image.Image, x: int, y: int) -> Image.Image:
+    # 越界部分crop会补0
+    return image.crop((-x, -y, image.width - x, image.height - y))
+
+
+def _spread_mask(glyph: Image.Image, spread: Spread) -> Image.Image:
+    """
+    将字形遮罩按spread叠加
+    同色文字重复绘制时每次的混合都是screen运算  而screen可以拆成先横向再纵向两趟  只需 横向次数 + 纵向次数 次运算
+    """
+    row = _shift(glyph, spread[0], spread[1])
+    for i in range(1, spread[2]):
+        row = ImageChops.screen(row, _shift(glyph, spread[0] + i, spread[1]))
+    result = row
+    for j in range(1, spread[3]):
+        result = ImageChops.screen(result, _shift(row, 0, j))
+    return result
+
+
+class OutlinedText:
+    """
+    描边文字
+    只光栅化一次字形  外发光(描边)与文字本体的遮罩由字形平移叠加得到
+    效果与原先在多个偏移位置重复调用 ImageDraw.text 一致
+
+    :param text: 文本  支持多行
+    :param fontFile: 字体文件
+    :param size: 字号
+    :param anchor: 文字锚点  与 ImageDraw.text 相同
+    :param fraction: 绘制坐标的小数部分  影响亚像素渲染
+    :param outline: 描边的平移范围
+    :param fill: 文字本体的平移范围  None为不绘制本体
+    """
+
+    def __init__(self,
+                 text: str,
+                 fontFile: str,
+                 size: int,
+                 anchor: Optional[str],
+                 fraction: Tuple[float, float],
+                 outline: Spread,
+                 fill: Optional[Spread]) -> None:
+        font = get_font(fontFile, size)
+        spreads = [outline] if fill is None else [outline, fill]
+        box = _measureDraw.textbbox(fraction, text, font=font, anchor=anchor)
+        minX = min(s[0] for s in spreads)
+        minY = min(s[1] for s in spreads)
+        maxX = max(s[0] + s[2] - 1 for s in spreads)
+        maxY = max(s[1] + s[3] - 1 for s in spreads)
+        left = math.floor(box[0]) - 1
+        top = math.floor(box[1]) - 1
+        # 遮罩左上角相对于绘制坐标整数部分的偏移
+        self.offset = (left + minX, top + minY)
+        width = math.ceil(box[2]) + 1 - left + maxX - minX
+        height = math.ceil(box[3]) + 1 - top + maxY - minY
+
+        # 字形画在不平移的位置  平移量统一减去最小平移量  保证平移后不会越过画布左上边界
+        glyph = Image.new("L", (width, height), 0)
+        ImageDraw.Draw(glyph).text((fraction[0] - left, fraction[1] - top), text, fill=255, font=font, anchor=anchor)
+        self.outlineMask = _spread_mask(glyph, (outline[0] - minX, outline[1] - minY, outline[2], outline[3]))
+        self.fillMask = None if fill is None else _spread_mask(glyph, (fill[0] - minX, fill[1] - minY, fill[2], fill[3]))
+        glyph.close()
+        self.size = (width, height)
+
+    def draw(self,
+             target: Image.Image,
+             xy: Tuple[int, int],
+             outlineColor: Tuple[int, ...] = (255, 255, 255),
+             fillColor: Tuple[int, ...] = (82, 82, 82)) -> None:
+        """
+        将描边文字画到目标图片上  xy须与创建时的坐标小数部分一致
+
+        :param target: 目标图片
+        :param xy: 绘制坐标  与 ImageDraw.text 的坐标含义相同
+        """
+        position = (math.floor(xy[0]) + self.offset[0], math.floor(xy[1]) + self.offset[1])
+        target.paste(outlineColor, position, self.outlineMask)
+        if self.fillMask is not None:
+            target.paste(fillColor, position, self.fillMask)
+
+
+@lru_cache(maxsize=1024)
+def outlined_text(text: str,
+                  fontFile: str,
+                  size: int,
+                  outline: Spread,
+                  fill: Optional[Spread] = None,
+                  anchor: Optional[str] = None,
+                  fraction: Tuple[float, float] = (0, 0)) -> OutlinedText:
+    """
+    获取描边文字的遮罩  以 (文本, 字体, 字号, 平移参数, 锚点, 坐标小数部分) 为键缓存
+    """
+    return OutlinedText(text, fontFile, size, anchor, fraction, outline, fill)
+
+
+def draw_outlined_text(target: Image.Image,
+                       xy: Tuple[float, float],
+                       text: str,
+                       fontFile: str,
+                       size: int,
+                       outline: Spread,
+                       fill: Optional[Spread] = None,
+                       outlineColor: Tuple[int, ...] = (255, 255, 255),
+                       fillColor: Tuple[int, ...] = (82, 82, 82),
+                       anchor: Optional[str] = None) -> None:
+    """
+    在目标图片上绘制描边文字  替代在多个偏移位置重复调用 ImageDraw.text 的写法
+
+    :param target: 目标图片
+    :param xy: 绘制坐标  可以是小数
+    :param outline: 描边的平移范围 (x偏移, y偏移, 横向次数, 纵向次数)
+    :param fill: 文字本体的平移范围  None为不绘制本体
+    """
+    fraction = (xy[0] - math.floor(xy[0]), xy[1] - math.floor(xy[1]))
+    outlined_text(text, fontFile, size, outline, fill, anchor, fraction).draw(target, xy, outlineColor, fillColor)
+
+
+def outline_cache_info() -> dict:
+    return outlined_text.cache_info()._asdict()
@@ -0,0 +1,166 @@
+import math
+import os
+import threading
+
+from PIL import Image
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .sprite_registry import sprite_registry
+from .monster_sprite import monster_sprite_cache
+
+texturePath = os.path.join(os.path.dirname(__file__), "Resource")
+
+# boss阴影中心的纵坐标  依次为1~5王
+ACTUAL_Y = (878, 801, 595, 862, 514)
+MAX_BOSS_INDEX = 13
+
+
+class SceneLayout(NamedTuple):
+    """
+    一套boss阵容的场景布局
+
+    bossIds: 五个boss的编号
+    positions: 五个boss贴图左上角在画布中的坐标
+    connectors: 旋转好的连结线及其粘贴坐标  已裁去透明边缘  不可修改
+    """
+    bossIds: Tuple[str, ...]
+    positions: Tuple[Tuple[int, int], ...]
+    connectors: Tuple[Tuple[Image.Image, Tuple[int, int]], ...]
+
+
+def build_name_index(geometry: dict) -> Dict[int, Dict[str, str]]:
+    """
+    由 data.json 建立 boss名称 -> boss编号 的反向索引
+    同一位置出现重名时与逐个比较一样取编号最小者
+
+    :param geometry: monster_icon/data.json 的内容
+    :return: {几王: {中文名: boss编号}}
+    """
+    index: Dict[int, Dict[str, str]] = {}
+    for bossNum in range(1, 6):
+        names: Dict[str, str] = {}
+        for i in range(1, MAX_BOSS_INDEX + 1):
+            bossId = str(bossNum * 1000 + i)
+            if bossId in geometry:
+                names.setdefault(geometry[bossId]["cnName"], bossId)
+        index[bossNum] = names
+    return index
+
+
+def _connector(stageLine: Image.Image, start: Tuple[int, int], end: Tuple[int, int]) -> Optional[Tuple[Image.Image, Tuple[int, int]]]:
+    # 计算连结线长度，先算连结线X长度及Y长度，勾股定理算第三边长（这次真的是勾股定理x
+    deltaX = end[0] - start[0]
+    deltaY = start[1] - end[1]
+    lineLong = math.sqrt(pow(deltaX, 2) + pow(deltaY, 2))
+    actualLine = stageLine.resize((int(lineLong), 20))
+    # 计算需要的旋转角度，用反正切倒推角度
+    lineAngle = math.atan2(deltaY, deltaX)
+    lineAngle = lineAngle / math.pi * 180
+    offsetAngleY = int(lineLong / 2 * math.sin(math.radians(lineAngle)))
+    # 创建更大的画布，否则旋转后的连结线会因为画布不够大而被裁切
+    lineImage = Image.new("RGBA", (actualLine.width, actualLine.width), (0, 0, 0, 0))
+    lineImage.paste(actualLine, (0, int(actualLine.width / 2) - 10), mask=actualLine)
+    lineImage = lineImage.rotate(lineAngle)
+    # 这里需要算出线段初始点对应图片的坐标，否则会产生位移
+    position = (start[0], start[1] - int(actualLine.width / 2) + 10 - offsetAngleY)
+    actualLine.close()
+    # 透明区域paste时不会改变画布  裁掉后结果不变
+    bbox = lineImage.getchannel("A").getbbox()
+    if bbox is None:
+        lineImage.close()
+        return None
+    connector = lineImage.crop(bbox)
+    lineImage.close()
+    return connector, (position[0] + bbox[0], position[1] + bbox[1])
+
+
+class SceneLayoutPlanner:
+    """
+    场景布局规划
+    boss坐标与连结线只取决于五个boss的阵容和画布宽度  每套阵容只计算一次
+    连结线在计算时就完成缩放和旋转  出图时直接粘贴
+
+    :param geometry: monster_icon/data.json 的内容
+    """
+
+    def __init__(self, geometry: dict) -> None:
+        self.geometry = geometry
+        self.nameIndex = build_name_index(geometry)
+        self.__layouts: Dict[Tuple[Tuple[str, ...], int], Tuple[Tuple[Image.Image, ...], SceneLayout]] = {}
+        self.__lock = threading.Lock()
+        self.plan_count = 0
+
+    def boss_id(self, bossNum: int, name: str) -> str:
+        """
+        根据boss名称查找boss编号
+
+        :param bossNum: 几王
+        :param name: boss中文名
+        :return: boss编号
+        """
+        bossId = self.nameIndex.get(bossNum, {}).get(name)
+        if bossId is None:
+            raise KeyError(f"{bossNum}王 {name} 不在 data.json 中")
+        return bossId
+
+    def __plan(self, bossIds: Tuple[str, ...], canvasWidth: int, stageLine: Image.Image, sprites: List[Image.Image]) -> SceneLayout:
+        totalPixelX = 0
+        for bossId, sprite in zip(bossIds, sprites):
+            # 野性狮鹫这玩意出现太频繁了，画幅还宽就很烦，导致画面会看起来很难看，单独给他做点处理
+            if bossId == "2004":
+                totalPixelX = totalPixelX + sprite.width - 70
+            else:
+                totalPixelX = totalPixelX + sprite.width
+        iconGap = int((canvasWidth - totalPixelX - 100) / 4)
+        # 计算出实际X轴数值
+        actualX = [50]
+        for xAxisNum in range(1, 5):
+            if bossIds[xAxisNum - 1] == "2004":
+                actualX.append(actualX[xAxisNum - 1] + sprites[xAxisNum - 1].width + iconGap - 70)
+            else:
+                actualX.append(actualX[xAxisNum - 1] + sprites[xAxisNum - 1].width + iconGap)
+
+        # 在上面的计算完成后，获得了actualX，ACTUAL_Y（其中actualX是图片左边缘，ACTUAL_Y是boss阴影中心）
+        battleRecordOffSet = actualX[3] + sprites[3].width - 1482
+        if battleRecordOffSet > 0:
+            actualX[3] = actualX[3] - battleRecordOffSet
+
+        connectors = []
+        for lineNum in range(0, 4):
+            connector = _connector(
+                stageLine,
+                (actualX[lineNum] + self.geometry[bossIds[lineNum]]["width"], ACTUAL_Y[lineNum]),
+                (actualX[lineNum + 1] + self.geometry[bossIds[lineNum + 1]]["width"], ACTUAL_Y[lineNum + 1]))
+            if connector is not None:
+                connectors.append(connector)
+
+        positions = tuple((actualX[i], ACTUAL_Y[i] - self.geometry[bossIds[i]]["height"]) for i in range(5))
+        return SceneLayout(bossIds=bossIds, positions=positions, connectors=tuple(connectors))
+
+    def plan(self, names: Tuple[str, ...], canvasWidth: int) -> SceneLayout:
+        """
+        获取一套阵容的场景布局
+
+        :param names: 1~5王的中文名
+        :param canvasWidth: 画布宽度
+        :return: 场景布局  其中的图片为共享对象  不可修改
+        """
+        bossIds = tuple(self.boss_id(bossNum, name) for bossNum, name in enumerate(names, 1))
+        # boss贴图的宽度决定了布局  存活与否不影响宽度
+        sources = (sprite_registry.template(os.path.join(texturePath, "stageLine.png")),) + \
+                  tuple(monster_sprite_cache.get(bossId, True, self.geometry).image for bossId in bossIds)
+        key = (bossIds, canvasWidth)
+        cached = self.__layouts.get(key)
+        if cached is not None and all(a is b for a, b in zip(cached[0], sources)):
+            return cached[1]
+        with self.__lock:
+            cached = self.__layouts.get(key)
+            if cached is None or not all(a is b for a, b in zip(cached[0], sources)):
+                cached = (sources, self.__plan(bossIds, canvasWidth, sources[0], list(sources[1:])))
+                self.__layouts[key] = cached
+                self.plan_count += 1
+        return cached[1]
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__layouts.clear()
@@ -0,0 +1,95 @@
+import os
+import threading
+
+from PIL import Image
+from typing import Dict, Tuple, Union
+from pathlib import Path
+
+from .asset_pack import asset_pack
+
+
+def readonly_view(template: Image.Image) -> Image.Image:
+    """
+    创建与模板共享像素数据的只读视图
+    对视图的写操作会触发Pillow的写时复制  模板本身不受影响
+
+    :param template: 模板图片
+    :return: 视图
+    """
+    view = template._new(template.im)
+    view.readonly = 1
+    return view
+
+
+class SpriteRegistry:
+    """
+    贴图缓存
+    每张贴图只解码一次并保存为不可变的模板  文件修改时间变化后自动重新解码
+    资源包中有该贴图且未过期时直接使用资源包映射的像素  不解码PNG
+
+    view() 返回与模板共享像素数据的只读视图  对视图进行 paste/ImageDraw 等写操作时Pillow会先自动复制一份  不会污染模板
+    copy() 直接返回可写的副本
+    """
+
+    def __init__(self) -> None:
+        self.__templates: Dict[str, Tuple[int, Image.Image]] = {}
+        self.__lock = threading.Lock()
+        self.decode_count = 0
+        self.pack_count = 0
+
+    def template(self, path: Union[str, Path]) -> Image.Image:
+        """
+        获取贴图模板  调用者不可修改也不可关闭模板
+
+        :param path: 贴图文件路径
+        :return: 贴图模板
+        """
+        path = str(path)
+        stat = os.stat(path)
+        mtime = stat.st_mtime_ns
+        cached = self.__templates.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with self.__lock:
+            cached = self.__templates.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            template = asset_pack.load(path, stat)
+            if template is not None:
+                self.pack_count += 1
+            else:
+                with Image.open(path) as image:
+                    image.load()
+                    template = image.copy()
+                self.decode_count += 1
+            self.__templates[path] = (mtime, template)
+        return template
+
+    def view(self, path: Union[str, Path]) -> Image.Image:
+        """
+        获取贴图的只读视图  写入时自动复制  可以随意关闭
+
+        :param path: 贴图文件路径
+        :return: 贴图视图
+        """
+        return readonly_view(self.template(path))
+
+    def copy(self, path: Union[str, Path]) -> Image.Image:
+        """
+        获取贴图的可写副本
+
+        :param path: 贴图文件路径
+        :return: 贴图副本
+        """
+        return self.template(path).copy()
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__templates.clear()
+
+
+sprite_registry = SpriteRegistry()
+
+
+def sprite_view(path: Union[str, Path]) -> Image.Image:
+    return sprite_registry.view(path)
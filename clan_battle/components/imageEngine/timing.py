@@ -0,0 +1,173 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# 直方图分桶上限(毫秒)  0.05ms起每档翻倍  最后一档约6.5s  更慢的计入溢出桶
+BUCKETS_MS = tuple(0.05 * 2 ** i for i in range(18))
+
+
+class Histogram:
+    """
+    单个阶段的耗时直方图
+    只保存各档计数  占用固定  分位数取所在档的上限  精度为一档(2倍)以内
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float) -> None:
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, q: float) -> float:
+        """
+        :param q: 0~1
+        :return: 分位数所在档的上限(毫秒)  不超过最大值
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, round(self.count * q))
+        seen = 0
+        for i, num in enumerate(self.counts):
+            seen += num
+            if seen >= rank:
+                return min(BUCKETS_MS[i], self.max) if i < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_ms": self.total,
+            "mean_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max,
+            "buckets": {BUCKETS_MS[i] if i < len(BUCKETS_MS) else float("inf"): num for i, num in enumerate(self.counts) if num},
+        }
+
+
+class _Span:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings: "Timings", name: str) -> None:
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.timings.record(self.name, time.perf_counter() - self.start)
+
+
+class Timings:
+    """
+    出图各阶段的耗时统计  常驻开启
+    每次记录只做一次分桶查找和几次加法  开销在微秒以下
+    同时维护累计统计和自上次汇总以来的统计  后者由定时任务写入日志后清空
+    嵌套的阶段各自计时  外层的耗时包含内层
+    进程池出图时  子进程中的耗时记录在子进程内  不会汇总到这里
+    """
+
+    def __init__(self) -> None:
+        self.enabled = True
+        self.__total: Dict[str, Histogram] = {}
+        self.__window: Dict[str, Histogram] = {}
+        self.__windowStart = time.time()
+        self.__lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        记录一次耗时
+
+        :param name: 阶段名
+        :param seconds: 耗时(秒)
+        """
+        if not self.enabled:
+            return
+        ms = seconds * 1000
+        with self.__lock:
+            total = self.__total.get(name)
+            if total is None:
+                total = self.__total[name] = Histogram()
+            total.add(ms)
+            window = self.__window.get(name)
+            if window is None:
+                window = self.__window[name] = Histogram()
+            window.add(ms)
+
+    def span(self, name: str) -> _Span:
+        """
+        计时上下文  with timings.span("encode"): ...
+        """
+        return _Span(self, name)
+
+    def timed(self, name: Optional[str] = None) -> Callable[[F], F]:
+        """
+        计时装饰器  默认以函数名为阶段名
+        """
+
+        def decorator(func: F) -> F:
+            stage = name or func.__name__
+
+            @wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+
+            return wrapper  # type: ignore
+
+        return decorator
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        启动以来各阶段的累计统计
+
+        :return: {阶段名: {"count", "total_ms", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms", "buckets"}}
+        """
+        with self.__lock:
+            return {name: histogram.snapshot() for name, histogram in self.__total.items()}
+
+    def summary(self) -> List[str]:
+        """
+        汇总自上次汇总以来的耗时  每个阶段一行  然后开始新的统计区间
+        区间内没有记录时返回空列表
+        """
+        with self.__lock:
+            window, self.__window = self.__window, {}
+            start, self.__windowStart = self.__windowStart, time.time()
+        minutes = (time.time() - start) / 60
+        return [
+            f"出图耗时 近{minutes:.0f}分钟 {name}: n={histogram.count} avg={histogram.total / histogram.count:.1f}ms "
+            f"p50={histogram.percentile(0.5):.1f}ms p95={histogram.percentile(0.95):.1f}ms max={histogram.max:.1f}ms"
+            for name, histogram in sorted(window.items(), key=lambda item: -item[1].total) if histogram.count
+        ]
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__total.clear()
+            self.__window.clear()
+            self.__windowStart = time.time()
+
+
+timings = Timings()
+span = timings.span
+timed = timings.timed
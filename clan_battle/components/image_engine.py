@@ -1,10 +1,15 @@
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image, ImageDraw, ImageFilter
 import os
 import sys
 from typing import Tuple, List, Optional, Dict, Set, Union, Any
 from pathlib import Path
-import httpx
-import asyncio
+
+from .imageEngine.font_registry import get_font
+from .imageEngine.sprite_registry import sprite_view
+from .imageEngine.corner_mask import round_corner
+from .imageEngine.avatar_cache import avatar_cache
+from .imageEngine.draw_pool import draw_pool
+from .imageEngine.avatar_downloader import avatar_downloader
 
 FILE_PATH = Path(sys._MEIPASS).resolve() if "_MEIPASS" in dir(sys) else Path(__file__).resolve().parent
 FONTS_PATH = os.path.join(FILE_PATH, "fonts")
@@ -125,7 +130,7 @@ class BackGroundGenerator:
 def get_font_image(text: str, size: int, color: Tuple[int, int, int] = (0, 0, 0)) -> Image.Image:
     if "\n" in text:
         return get_font_image_vertical(text, size, color)
-    image_font = ImageFont.truetype(FONTS, size)
+    image_font = get_font(FONTS, size)
     font_box = image_font.getbbox(text=text)
     background = Image.new("RGBA", (font_box[2] - font_box[0], font_box[3] - font_box[1]), (255, 255, 255, 0))
     background_draw = ImageDraw.Draw(background)
@@ -154,50 +159,10 @@ def center(source_image: Image.Image, target_image: Image.Image) -> Tuple[int, i
     return tuple(result)
 
 
-def round_corner(image: Image.Image, radius: Optional[int] = None) -> Image.Image:
-    if radius is None:
-        size = image.height
-    else:
-        size = radius * 2
-
-    circle_bg = Image.new("L", (size * 5, size * 5), 0)  # 已确保关闭
-    circle_draw = ImageDraw.Draw(circle_bg)
-    circle_draw.ellipse((0, 0, size * 5, size * 5), 255)
-    circle_bg = circle_bg.resize((size, size))
-
-    if radius is None:
-        circle_split_cursor_x = round(circle_bg.size[0] / 2)
-        circle_split = (circle_bg.crop((0, 0, circle_split_cursor_x, size)), circle_bg.crop((circle_split_cursor_x, 0, size, size)))
-
-        mask = Image.new("L", image.size, 255)  # 已确保关闭
-        mask.paste(circle_split[0], (0, 0))
-        mask.paste(circle_split[1], (image.width - circle_split[1].width, 0))
-    else:
-        circle_split = (
-            circle_bg.crop((0, 0, radius, radius)),
-            circle_bg.crop((radius, 0, radius * 2, radius)),
-            circle_bg.crop((0, radius, radius, radius * 2)),
-            circle_bg.crop((radius, radius, radius * 2, radius * 2)),
-        )
-        mask = Image.new("L", image.size, 255)  # 已确保关闭
-        mask.paste(circle_split[0], (0, 0))
-        mask.paste(circle_split[1], (image.width - radius, 0))
-        mask.paste(circle_split[2], (0, image.height - radius))
-        mask.paste(circle_split[3], (image.width - radius, image.height - radius))
-
-    mask_paste_bg = Image.new("RGBA", image.size, (255, 255, 255, 0))  # 已确保关闭
-
-    result = Image.composite(image, mask_paste_bg, mask)
-
-    circle_bg.close()
-    mask_paste_bg.close()
-    mask.close()
-    image.close()
-
-    return result
-
-
-def user_chips(head_icon: Image.Image, user_name: str, background_color: Tuple[int, int, int] = (189, 189, 189)) -> Image.Image:
+def user_chips(head_icon: Image.Image, user_name: str, background_color: Tuple[int, int, int] = (189, 189, 189), head_icon_ready: bool = False) -> Image.Image:
+    """
+    :param head_icon_ready: 头像已经缩放并切好圆角(来自头像缓存)  不再处理
+    """
     OVERALL_CHIPS_LIST_WITH = 400 - 10  # 左右各5边距
     CHIPS_LIST_WIDTH = OVERALL_CHIPS_LIST_WITH - 29
     TEXT_MAXIMUM_WIDTH = CHIPS_LIST_WIDTH - 35  # 25为chip本身  10为chip自己外边距以及user_chips外边距
@@ -205,8 +170,9 @@ def user_chips(head_icon: Image.Image, user_name: str, background_color: Tuple[i
     USER_NICKNAME_FONTSIZE = 20
     CHIPS_HEIGHT = 20
 
-    head_icon = head_icon.resize((USER_PROFILE_SIZE, USER_PROFILE_SIZE))
-    head_icon = round_corner(head_icon)
+    if not head_icon_ready:
+        head_icon = head_icon.resize((USER_PROFILE_SIZE, USER_PROFILE_SIZE))
+        head_icon = round_corner(head_icon)
 
     text_color = (255, 255, 255) if ((background_color[0] * 0.299 + background_color[1] * 0.587 + background_color[2] * 0.114) / 255) < 0.5 else (0, 0, 0)
 
@@ -317,13 +283,10 @@ def chips_list(chips_array: Dict[str, Any] = {}, text: str = "内容", backgroun
             continue
         if not isinstance(user_nickname, str):
             continue
-        user_profile_path = USER_HEADERS_PATH.joinpath(user_id + ".jpg")
-        if not user_profile_path.is_file():
-            user_profile_image = Image.new("RGBA", (20, 20), (255, 255, 255, 0))  # 已确保关闭
+        user_profile_image, found = avatar_cache.tile(USER_HEADERS_PATH.joinpath(user_id + ".jpg"), 20)  # 已确保关闭
+        if not found:
             glovar_missing_user_id.add(int(user_id))
-        else:
-            user_profile_image = Image.open(USER_HEADERS_PATH.joinpath(user_id + ".jpg"), "r")  # 已确保关闭
-        chips_image_list.append(user_chips(user_profile_image, user_nickname, chips_color))
+        chips_image_list.append(user_chips(user_profile_image, user_nickname, chips_color, head_icon_ready=True))
 
     chips_image_list.sort(key=lambda i: i.width, reverse=True)
 
@@ -468,7 +431,7 @@ class BossStatusImageCore:
         if not BOSS_ICON_PATH.joinpath(self.boss_icon_id + ".webp").is_file():
             boss_icon = Image.new("RGBA", (128, 128), (255, 255, 255, 0))  # 已确保关闭
         else:
-            boss_icon = Image.open(BOSS_ICON_PATH.joinpath(self.boss_icon_id + ".webp"), "r")  # 已确保关闭
+            boss_icon = sprite_view(BOSS_ICON_PATH.joinpath(self.boss_icon_id + ".webp"))  # 已确保关闭
 
         boss_icon = boss_icon.resize((BOSS_HEADER_SIZE, BOSS_HEADER_SIZE))
         boss_icon = round_corner(boss_icon, 10)
@@ -538,7 +501,7 @@ def generate_combind_boss_state_image(image_list: List[Union[Image.Image, BossSt
     module_count = 0
     format_color_flag = False
 
-    for this_image in image_list:
+    def module_generate(this_image: Union[Image.Image, BossStatusImageCore]) -> Tuple[Image.Image, Image.Image]:
         if isinstance(this_image, BossStatusImageCore):
             this_image = this_image.generate((254, 251, 234))
             # this_image.show()
@@ -546,9 +509,12 @@ def generate_combind_boss_state_image(image_list: List[Union[Image.Image, BossSt
             pass
         else:
             raise ValueError(f"Unknown image type: {type(this_image)}")
+        return this_image, makeShadow(round_corner(this_image, 10), 1, SHADOW_BORDER, (5, 5), (248, 239, 200), (248 - 20, 239 - 20, 200 - 20))
 
+    # 各模块互不依赖  并行生成后按原顺序拼接
+    for this_image, shadow_image in draw_pool.map([lambda this_image=this_image: module_generate(this_image) for this_image in image_list]):
         background.alpha_composite(
-            makeShadow(round_corner(this_image, 10), 1, SHADOW_BORDER, (5, 5), (248, 239, 200), (248 - 20, 239 - 20, 200 - 20)),
+            shadow_image,
             # round_corner(this_image, 10),
             (current_x_cursor, current_y_cursor),
         )
@@ -564,27 +530,12 @@ def generate_combind_boss_state_image(image_list: List[Union[Image.Image, BossSt
 
 
 async def download_pic(url: str, proxies: Optional[str] = None, file_name="") -> Optional[Path]:
-    image_path = USER_HEADERS_PATH.joinpath(file_name)
-    client = httpx.AsyncClient(proxies=proxies, timeout=5)
-    try:
-        async with client.stream(method="GET", url=url, timeout=15) as response:  # type: ignore # params={"proxies": [proxies]}
-            if response.status_code != 200:
-                raise ValueError(f"Image respond status code error: {response.status_code}")
-            with open(image_path, "wb") as f:
-                async for chunk in response.aiter_bytes():
-                    f.write(chunk)
-    except Exception:
-        return None
-    finally:
-        await client.aclose()
-    return image_path
+    return await avatar_downloader.fetch(url, USER_HEADERS_PATH.joinpath(file_name), proxies)
 
 
-async def download_user_profile_image(user_id_list: List[int]) -> None:
-    task_list = []
-    for this_user_id in user_id_list:
-        task_list.append(download_pic(f"http://q1.qlogo.cn/g?b=qq&nk={this_user_id}&s=1", file_name=f"{this_user_id}.jpg"))
-    await asyncio.gather(*task_list)
+async def download_user_profile_image(user_id_list: List[int], refresh: bool = False) -> None:
+    # 共用的下载器限制了并发数和请求频率  整个数据库的用户一起传进来也不会同时打开大量连接
+    await avatar_downloader.download(user_id_list, USER_HEADERS_PATH, refresh)
 
 
 async def download_missing_user_profile() -> None:
@@ -0,0 +1,149 @@
+import os
+import re
+import sys
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+from PIL import Image
+
+from .output_encoder import OutputSettings, encode_image, encode_cq_image
+
+STORE_PATH = Path.cwd().resolve().joinpath("./yobot_data/image_cache/rendered") if "_MEIPASS" in dir(sys) else Path(os.path.dirname(__file__)).parents[2] / 'yobot_data' / 'image_cache' / 'rendered'
+
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+MIMETYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+NAME_PATTERN = re.compile(r'^([0-9a-f]{64})\.(jpg|png|webp)$')
+# image_reply 生成的以地址发送的CQ码  取出其中的文件名
+REPLY_PATTERN = re.compile(r'^\[CQ:image,file=[^\]]*?([0-9a-f]{64}\.(?:jpg|png|webp))\]$')
+
+
+class ImageStore:
+	"""
+	按内容寻址的图片存储
+	文件名为图片内容的sha256  内容相同的图片只保存一份  文件名不变则内容不变  可以被永久缓存
+	只依赖文件系统  出图进程与网页服务进程可以不同
+
+	:param root: 存储目录
+	:param max_files: 最多保存的图片数  超出后删除最旧的图片
+	"""
+
+	def __init__(self, root: Path = STORE_PATH, max_files: int = 256) -> None:
+		self.root = root
+		self.max_files = max_files
+		self.__lock = threading.Lock()
+		self.__puts = 0
+
+	def put(self, data: Union[bytes, bytearray], format: str = 'JPEG') -> str:
+		"""
+		保存图片
+
+		:param data: 编码好的图片
+		:param format: 图片格式  决定扩展名
+		:return: 文件名
+		"""
+		name = f'{hashlib.sha256(data).hexdigest()}.{EXTENSIONS[format.upper()]}'
+		path = self.root / name
+		if path.is_file():
+			# 更新修改时间  避免常用的图片被当作旧图片清理掉
+			os.utime(path)
+			return name
+		self.root.mkdir(parents=True, exist_ok=True)
+		self.__write(path, data)
+		with self.__lock:
+			self.__puts += 1
+			if self.__puts % 16 == 0:
+				self.prune()
+		return name
+
+	def __write(self, path: Path, data: Union[bytes, bytearray]) -> None:
+		# 先写临时文件再替换  读取方不会读到写了一半的文件
+		temp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+		temp_path.write_bytes(data)
+		os.replace(temp_path, path)
+
+	def set_latest(self, group_id: int, name: str) -> None:
+		"""
+		记录群最新的状态图  网页可以直接显示  不必重新出图
+		"""
+		self.root.mkdir(parents=True, exist_ok=True)
+		self.__write(self.root / f'{group_id}.latest', name.encode())
+
+	def latest(self, group_id: int) -> Optional[str]:
+		try:
+			name = (self.root / f'{group_id}.latest').read_text()
+		except OSError:
+			return None
+		return name if self.get(name) is not None else None
+
+	def get(self, name: str) -> Optional[Tuple[Path, str]]:
+		"""
+		查找图片
+
+		:param name: 文件名
+		:return: (文件路径, MIME类型)  文件名不合法或图片不存在时为None
+		"""
+		match = NAME_PATTERN.match(name)
+		if match is None:
+			return None
+		path = self.root / name
+		if not path.is_file():
+			return None
+		return path, MIMETYPES[match.group(2)]
+
+	def touch_reply(self, reply: str) -> bool:
+		"""
+		检查缓存的CQ码引用的图片是否还在  在时更新修改时间  避免被当作旧图片清理掉
+		以base64内联发送的CQ码不引用文件  总是可用
+
+		:param reply: image_reply 返回的CQ码
+		:return: 是否可以直接发送
+		"""
+		match = REPLY_PATTERN.match(reply)
+		if match is None:
+			return True
+		found = self.get(match.group(1))
+		if found is None:
+			return False
+		try:
+			os.utime(found[0])
+		except OSError:
+			# 刚好被清理掉
+			return False
+		return True
+
+	def prune(self) -> None:
+		"""
+		只保留最近使用的 max_files 张图片
+		"""
+		try:
+			files = sorted(
+				(entry for entry in os.scandir(self.root) if NAME_PATTERN.match(entry.name)),
+				key=lambda entry: entry.stat().st_mtime,
+				reverse=True,
+			)
+			for entry in files[self.max_files:]:
+				os.unlink(entry.path)
+		except OSError:
+			pass
+
+
+image_store = ImageStore()
+
+
+def image_reply(image: Image.Image, settings: OutputSettings, base_url: Optional[str] = None, group_id: Optional[int] = None) -> str:
+	"""
+	将图片转为CQ码
+
+	:param image: 图片  不会被修改或关闭
+	:param settings: 输出设置
+	:param base_url: 图片路由的地址  以/结尾  为None时以base64内联发送
+	:param group_id: 群号  给出时记录为该群最新的状态图
+	"""
+	if base_url is None:
+		return encode_cq_image(image, settings)
+	name = image_store.put(encode_image(image, settings), settings.format)
+	if group_id is not None:
+		image_store.set_latest(group_id, name)
+	return f'[CQ:image,file={base_url}{name}]'
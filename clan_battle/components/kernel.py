@@ -10,13 +10,20 @@ from urllib.parse import urljoin
 
 from aiocqhttp.api import Api
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
 from ...ybdata import Clan_group, Clan_member, User
 from ..exception import ClanBattleError, InputError, GroupNotExist
 from ..util import atqq
 from .define import Commands, Server
 from .image_engine import image_engine_init
-from .imageEngine.imageEngine import download_missing_user_profile
+from .realize import boss_status_summary_async
+from .render_service import render_executor
+from .imageEngine.timing import timings
+from .imageEngine.draw_pool import draw_pool
+from .imageEngine.canvas_pool import canvas_pool
+from .imageEngine.avatar_downloader import avatar_downloader, AVATAR_URL
+from .imageEngine.imageEngine import refresh_user_profile_image
 from .multi_cq_utils import refresh
 
 _logger = logging.getLogger(__name__)
@@ -34,11 +41,34 @@ def init(self,
 	self.level_by_cycle = glo_setting['level_by_cycle']
 	self.api = bot_api
 	self.group_data_list = {}
+	self.group_state_list = {}
 
 	# log
 	if not os.path.exists(os.path.join(glo_setting['dirname'], 'log')):
 		os.mkdir(os.path.join(glo_setting['dirname'], 'log'))
 	image_engine_init()
+	render_executor.configure(
+		kind = glo_setting.get('render_executor', 'thread'),
+		workers = glo_setting.get('render_workers', 2),
+		max_pending = glo_setting.get('render_queue_size', 8),
+		timeout = glo_setting.get('render_timeout', 30),
+	)
+	# 单张图内各boss组件的并行绘制线程数  1为串行
+	draw_pool.configure(glo_setting.get('render_draw_workers', draw_pool.workers))
+	# 同时出图的最大帧数  render_mode 为 pooled 时状态图画在复用的画布上  不保留每个群的上一帧
+	canvas_pool.configure(glo_setting.get('render_max_frames', 2))
+	# 头像下载  所有下载共用一个客户端  限制并发数与每秒请求数
+	avatar_downloader.configure(
+		url = glo_setting.get('avatar_url', AVATAR_URL),
+		concurrency = glo_setting.get('avatar_download_concurrency', 8),
+		rate = glo_setting.get('avatar_download_rate', 20),
+		retries = glo_setting.get('avatar_download_retries', 2),
+		# 已有头像的有效期(秒)  过期后以条件请求检查更新
+		ttl = glo_setting.get('avatar_refresh_ttl', 86400),
+		# 下载失败的QQ号暂停请求的时长(秒)  连续失败时翻倍  不超过上限
+		failure_backoff = glo_setting.get('avatar_failure_backoff', 60),
+		max_failure_backoff = glo_setting.get('avatar_max_failure_backoff', 86400),
+	)
 
 	formater = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s')
 	filehandler = logging.FileHandler(
@@ -78,7 +108,26 @@ def jobs(self):
 	def ensure_future_update_all_group_members():
 		asyncio.ensure_future(self._update_group_list_async())
 
-	return ((trigger, ensure_future_update_all_group_members),)
+	job_list = [(trigger, ensure_future_update_all_group_members)]
+
+	# 定时将出图各阶段的耗时汇总写入日志  0为不汇总
+	timing_interval = self.setting.get('render_timing_interval', 60)
+	if timing_interval:
+		def log_render_timing():
+			for line in timings.summary():
+				_logger.info(line)
+
+		job_list.append((IntervalTrigger(minutes=timing_interval), log_render_timing))
+
+	# 定时检查已过期的头像  0为不检查
+	avatar_refresh_interval = self.setting.get('avatar_refresh_interval', 60)
+	if avatar_refresh_interval:
+		def ensure_future_refresh_user_profile_image():
+			asyncio.ensure_future(refresh_user_profile_image())
+
+		job_list.append((IntervalTrigger(minutes=avatar_refresh_interval), ensure_future_refresh_user_profile_image))
+
+	return tuple(job_list)
 
 #匹配
 def match(self, cmd):
@@ -145,12 +194,9 @@ def execute(self, match_num, ctx):
 
 	elif match_num == 3:  # 状态
 		if cmd != '状态': return
-		try: 
-			boss_summary = self.boss_status_summary(group_id)
-			asyncio.ensure_future(download_missing_user_profile())
-		except ClanBattleError as e:
-			return str(e)
-		return boss_summary
+		# 出图在出图执行器中进行,完成后直接发送,不阻塞事件循环
+		asyncio.ensure_future(boss_status_summary_async(self, group_id))
+		return
 
 
 	elif match_num == 4:  # 报刀
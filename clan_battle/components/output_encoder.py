@@ -0,0 +1,217 @@
+import time
+import base64
+from PIL import Image
+from typing import Any, Dict, NamedTuple, Optional, Union
+
+from .imageEngine.timing import timings, span
+
+CQ_PREFIX = b'[CQ:image,file=base64://'
+CQ_SUFFIX = b']'
+
+
+class OutputSettings(NamedTuple):
+	"""
+	图片输出设置
+
+	format: JPEG / PNG / WEBP
+	quality: JPEG/WEBP质量  启用 max_bytes 时为质量上限
+	subsampling: JPEG色度抽样  0=4:4:4 1=4:2:2 2=4:2:0  None为Pillow默认
+	scale: 输出前缩放比例  1为不缩放
+	max_bytes: 编码后的目标大小(字节)  0为不限制  超出时在 min_quality~quality 之间查找满足大小的最高质量
+	min_quality: 查找质量时的下限  最低质量仍然超出时使用最低质量
+	"""
+	format: str = 'JPEG'
+	quality: int = 95
+	subsampling: Optional[int] = None
+	scale: float = 1.0
+	max_bytes: int = 0
+	min_quality: int = 50
+
+
+DEFAULT_OUTPUT = {
+	'state': OutputSettings(format='JPEG', quality=95),
+	'text': OutputSettings(format='PNG'),
+}
+
+
+def output_settings(setting: Dict[str, Any], group_id: Optional[int] = None, kind: str = 'state') -> OutputSettings:
+	"""
+	读取图片输出设置  群设置覆盖全局设置  全局设置覆盖默认值
+
+	配置格式:
+		"image_output": {
+			"state": {"format": "JPEG", "quality": 95, "max_bytes": 0},
+			"text": {"format": "PNG"},
+			"groups": {"<群号>": {"state": {...}, "text": {...}}}
+		}
+
+	:param setting: 全局设置
+	:param group_id: 群号
+	:param kind: state 为状态图  text 为文字图
+	"""
+	conf = setting.get('image_output') or {}
+	values = DEFAULT_OUTPUT[kind]._asdict()
+	values.update(conf.get(kind) or {})
+	if group_id is not None:
+		values.update(((conf.get('groups') or {}).get(str(group_id)) or {}).get(kind) or {})
+	values['format'] = str(values['format']).upper()
+	return OutputSettings(**{k: v for k, v in values.items() if k in OutputSettings._fields})
+
+
+class CountingWriter:
+	"""
+	只统计写入字节数的文件对象  用于查找质量时试编码  不保存数据
+	"""
+
+	def __init__(self) -> None:
+		self.size = 0
+
+	def write(self, data: bytes) -> int:
+		self.size += len(data)
+		return len(data)
+
+	def flush(self) -> None:
+		pass
+
+
+class BytesWriter:
+	"""
+	直接写入bytearray的文件对象  编码结束后无需再复制一遍
+	"""
+
+	def __init__(self) -> None:
+		self.buffer = bytearray()
+
+	def write(self, data: Union[bytes, bytearray, memoryview]) -> int:
+		self.buffer += data
+		return len(data)
+
+	def flush(self) -> None:
+		pass
+
+
+class Base64Writer:
+	"""
+	边写入边进行base64编码的文件对象
+	编码器直接写入这里  不需要先写入BytesIO再getvalue整体复制一遍
+	凑不满3字节的尾巴留到下一次写入再编码
+	累计base64编码本身的耗时  供耗时统计区分图片编码与base64
+	"""
+
+	def __init__(self, prefix: bytes = b'') -> None:
+		self.buffer = bytearray(prefix)
+		self.__rest = b''
+		self.size = 0
+		self.elapsed = 0.0
+
+	def write(self, data: Union[bytes, bytearray, memoryview]) -> int:
+		start = time.perf_counter()
+		length = len(data)
+		self.size += length
+		if self.__rest:
+			data = self.__rest + bytes(data)
+		cut = len(data) - len(data) % 3
+		if cut:
+			self.buffer += base64.b64encode(memoryview(data)[:cut])
+		self.__rest = bytes(data[cut:])
+		self.elapsed += time.perf_counter() - start
+		return length
+
+	def flush(self) -> None:
+		pass
+
+	def finish(self, suffix: bytes = b'') -> bytearray:
+		if self.__rest:
+			self.buffer += base64.b64encode(self.__rest)
+			self.__rest = b''
+		self.buffer += suffix
+		return self.buffer
+
+
+def _save_params(settings: OutputSettings, quality: int) -> Dict[str, Any]:
+	if settings.format == 'JPEG':
+		params = {'quality': quality}
+		if settings.subsampling is not None:
+			params['subsampling'] = settings.subsampling
+		return params
+	if settings.format == 'WEBP':
+		return {'quality': quality}
+	return {}
+
+
+def prepare_image(image: Image.Image, settings: OutputSettings) -> Image.Image:
+	"""
+	按输出设置缩放并转换颜色模式  返回新图片  原图不变
+	"""
+	if settings.scale != 1:
+		size = (max(1, round(image.width * settings.scale)), max(1, round(image.height * settings.scale)))
+		image = image.resize(size, Image.LANCZOS)
+	if settings.format == 'JPEG' and image.mode != 'RGB':
+		return image.convert('RGB')
+	if image.mode not in ('RGB', 'RGBA', 'L', 'P'):
+		return image.convert('RGBA')
+	return image
+
+
+def pick_quality(image: Image.Image, settings: OutputSettings) -> int:
+	"""
+	在 min_quality~quality 之间二分查找编码后不超过 max_bytes 的最高质量
+	试编码只统计大小不保存数据
+	"""
+	if not settings.max_bytes or settings.format == 'PNG':
+		return settings.quality
+
+	@timings.timed('encode_trial')
+	def encoded_size(quality: int) -> int:
+		writer = CountingWriter()
+		image.save(writer, format=settings.format, **_save_params(settings, quality))
+		return writer.size
+
+	if encoded_size(settings.quality) <= settings.max_bytes:
+		return settings.quality
+	low, high = settings.min_quality, settings.quality - 1
+	best = settings.min_quality
+	while low <= high:
+		middle = (low + high) // 2
+		if encoded_size(middle) <= settings.max_bytes:
+			best = middle
+			low = middle + 1
+		else:
+			high = middle - 1
+	return best
+
+
+def encode_image(image: Image.Image, settings: OutputSettings = DEFAULT_OUTPUT['state']) -> bytearray:
+	"""
+	按输出设置编码图片
+
+	:param image: 图片  不会被修改或关闭
+	:param settings: 输出设置
+	:return: 编码后的数据
+	"""
+	output = prepare_image(image, settings)
+	quality = pick_quality(output, settings)
+	writer = BytesWriter()
+	with span('encode'):
+		output.save(writer, format=settings.format, **_save_params(settings, quality))
+	if output is not image:
+		output.close()
+	return writer.buffer
+
+
+def encode_cq_image(image: Image.Image, settings: OutputSettings = DEFAULT_OUTPUT['state']) -> str:
+	"""
+	将图片编码为 [CQ:image,file=base64://...]
+
+	:param image: 图片  不会被修改或关闭
+	:param settings: 输出设置
+	"""
+	output = prepare_image(image, settings)
+	quality = pick_quality(output, settings)
+	writer = Base64Writer(CQ_PREFIX)
+	with span('encode'):
+		output.save(writer, format=settings.format, **_save_params(settings, quality))
+	timings.record('base64', writer.elapsed)
+	if output is not image:
+		output.close()
+	return writer.finish(CQ_SUFFIX).decode('ascii')
@@ -3,27 +3,34 @@ import os
 import sys
 import json
 import peewee
-import base64
 import random
 import string
 import asyncio
 import logging
 from pathlib import Path
-from io import BytesIO
+from urllib.parse import urljoin
 from PIL import Image, ImageFont, ImageDraw
 from typing import Any, Dict, List, Optional, Union, Tuple
 
 from .handler import SubscribeHandler
+from .group_state import GroupState
 
 from ..typing import ClanBattleReport, Groupid, Pcr_date, QQid
 from ...web_util import async_cached_func
 from ..util import atqq, pcr_datetime, pcr_timestamp, timed_cached_func
 
 from ...ybdata import Clan_challenge, Clan_group, Clan_member, User, Clan_group_backups
-from ..exception import GroupError, GroupNotExist, InputError, UserError, UserNotInGroup
+from ..exception import ClanBattleError, GroupError, GroupNotExist, InputError, UserError, UserNotInGroup
 from .multi_cq_utils import who_am_i
 from .image_engine import download_user_profile_image, generate_combind_boss_state_image, BossStatusImageCore, get_process_image, GroupStateBlock
-from .imageEngine.imageEngine import boss_statue_draw, state_image_generate
+from .imageEngine.imageEngine import headPicturePath, mark_missing_user_profile, download_missing_user_profile
+from .imageEngine.font_registry import get_font
+from .imageEngine.timing import timed
+from .render_cache import render_cache, render_key, avatar_versions
+from .render_service import render_coalescer, render_state_image
+from .output_encoder import output_settings
+from .image_store import image_reply
+from .challenge_tally import member_blades, record_message
 
 _logger = logging.getLogger(__name__)
 FILE_PATH = Path(sys._MEIPASS).resolve() if "_MEIPASS" in dir(sys) else Path(__file__).resolve().parent
@@ -31,22 +38,25 @@ FILE_PATH = Path(sys._MEIPASS).resolve() if "_MEIPASS" in dir(sys) else Path(__f
 def safe_load_json(text, back = None):
 	return text and json.loads(text) or back
 
-def text_2_pic(self, text:string, weight:int, height:int, bg_color:Tuple, text_color:string, font_size:int, text_offset:Tuple):
+def text_2_pic(self, text:string, weight:int, height:int, bg_color:Tuple, text_color:string, font_size:int, text_offset:Tuple, group_id:Optional[int] = None):
 	im = Image.new("RGB", (weight, height), bg_color)
 	dr = ImageDraw.Draw(im)
 	FONTS_PATH = os.path.join(FILE_PATH,'fonts')
 	FONTS = os.path.join(FONTS_PATH,'msyh.ttf')
 	try:
     # 尝试使用指定的字体加载
-		font = ImageFont.truetype(FONTS, font_size)
+		font = get_font(FONTS, font_size)
 	except OSError:
     # 加载失败时使用默认字体
 		font = ImageFont.load_default()
 	dr.text(text_offset, text, font=font, fill=text_color)
-	bio = BytesIO()
-	im.save(bio, format='PNG')
-	base64_str = 'base64://' + base64.b64encode(bio.getvalue()).decode()
-	return f"[CQ:image,file={base64_str}]"
+	return image_reply(im, output_settings(self.setting, group_id, 'text'), _image_base_url(self))
+
+#图片路由的地址,设置为以base64发送时为None
+def _image_base_url(self) -> Optional[str]:
+	if self.setting.get('image_reply', 'url') != 'url':
+		return None
+	return urljoin(self.setting['public_address'], '{}clan/image/'.format(self.setting['public_basepath']))
 
 def future_operation(self, group, msg):
 	self._boss_status[group.group_id].set_result((self._boss_data_dict(group), group.boss_cycle, msg))
@@ -63,6 +73,13 @@ def get_clan_group(self, group_id):
 			self.group_data_list[group_id] = group
 		return group
 
+#获取公会当前状态的解析结果  各JSON字段只在变化后重新解析  返回的数据只读
+def group_state(self, group: Clan_group) -> GroupState:
+	state = self.group_state_list.get(group.group_id)
+	if state is None:
+		state = self.group_state_list[group.group_id] = GroupState()
+	return state.sync(group)
+
 #阶段周目
 def _level_by_cycle(self, cycle, game_server=None):
 	level = 0
@@ -72,6 +89,7 @@ def _level_by_cycle(self, cycle, game_server=None):
 	return level
 
 #通过qq号获取名字
+@timed('nickname')
 @timed_cached_func(128, 3600, ignore_self=True)
 def _get_nickname_by_qqid(self, qqid) -> Union[str, None]:
 	user = User.get_or_create(qqid=qqid)[0]
@@ -168,14 +186,16 @@ def _update_user_profile_image(self, user_id: Optional[Union[int,List[int]]] = N
 	if group_id:
 		for this_user in Clan_member.select().where(Clan_member.group_id == group_id):
 			update_qqid_list.add(this_user.qqid)
-	asyncio.ensure_future(download_user_profile_image(list(update_qqid_list)))
+	# 主动更新  忽略有效期  仍然是条件请求
+	asyncio.ensure_future(download_user_profile_image(list(update_qqid_list), refresh=True))
 
 #获取boss当前数据
 def _boss_data_dict(self, group: Clan_group) -> Dict[str, Any]:
 	cycle = group.boss_cycle
-	now_health = safe_load_json(group.now_cycle_boss_health, {})
-	next_health = safe_load_json(group.next_cycle_boss_health, {})
-	challenging_member_list = safe_load_json(group.challenging_member_list, {})
+	state = group_state(self, group)
+	now_health = state.now_health
+	next_health = state.next_health
+	challenging_member_list = state.challenging
 
 	back_data = {}
 	for i in range(5):
@@ -306,8 +326,7 @@ def modify(self, group_id: Groupid, cycle=None, bossData=None):
 	if group is None: raise GroupNotExist
 
 	next_cycle_level = self._level_by_cycle(cycle and cycle+1 or group.boss_cycle+1, group.game_server)
-	now_health = safe_load_json(group.now_cycle_boss_health, {})
-	next_health = safe_load_json(group.next_cycle_boss_health, {})
+	now_health, next_health = group_state(self, group).health_copy()
 	now_cycle_level = self._level_by_cycle(cycle or group.boss_cycle, group.game_server)
 
 	for boss_num, data in bossData.items():
@@ -550,6 +569,24 @@ def boss_status_summary(self, group_id:Groupid) -> str:
 
 	return boss_summary
 
+async def boss_status_summary_async(self, group_id:Groupid) -> None:
+	"""
+	在出图执行器中生成状态图  完成后直接发送到群里
+	"""
+	try:
+		boss_summary = await challenger_info_async(self, group_id)
+	except ClanBattleError as e:
+		boss_summary = str(e)
+	except Exception as e:
+		_logger.exception(e)
+		return
+	await self.api.send_group_msg(
+		self_id = who_am_i(group_id),
+		group_id = group_id,
+		message = boss_summary,
+	)
+	await download_missing_user_profile()
+
 
 #报刀
 def challenge(self,
@@ -608,9 +645,9 @@ def challenge(self,
 
 	boss_num = str(boss_num)
 	boss_cycle = group.boss_cycle
-	challenging_member_list = safe_load_json(group.challenging_member_list, {})
-	now_cycle_boss_health = safe_load_json(group.now_cycle_boss_health, {})
-	next_cycle_boss_health = safe_load_json(group.next_cycle_boss_health, {})
+	state = group_state(self, group)
+	challenging_member_list = state.challenging
+	now_cycle_boss_health, next_cycle_boss_health = state.health_copy()
 	real_cycle_boss_health = now_cycle_boss_health
 	is_continue = is_continue or (boss_num in challenging_member_list and challenging_member_list[boss_num][str(qqid)]['is_continue'] or False)
 	if now_cycle_boss_health[boss_num] == 0 and next_cycle_boss_health[boss_num] != 0:
@@ -746,8 +783,7 @@ def undo(self, group_id: Groupid, qqid: QQid) :
 	last_cycle = last_challenge.boss_cycle	#上一刀的周目数
 	level = self._level_by_cycle(last_cycle, group.game_server)#阶段
 
-	now_cycle_boss_health = safe_load_json(group.now_cycle_boss_health, {})
-	next_cycle_boss_health = safe_load_json(group.next_cycle_boss_health, {})
+	now_cycle_boss_health, next_cycle_boss_health = group_state(self, group).health_copy()
 	real_cycle_boss_health = now_cycle_boss_health #用来记录上一刀打的是哪个周目的boss
 
 	if last_cycle < group.boss_cycle:	# 判断被撤销的一刀是否是切换周目的一刀
@@ -930,10 +966,11 @@ def put_on_the_tree(self, group_id: Groupid, qqid: QQid, message=None, boss_num=
 		if str(self.get_in_boss_num(group_id, challenger)) != str(boss_num):
 			raise GroupError('你申请的王和挂树的王不一样，怎么挂树啊 (╯‵□′)╯︵┻━┻')
 
+	entry = group_state(self, group).entry(challenger)
+	if entry is not None and entry.get('tree'):
+		raise GroupError('您已经在树上了')
+
 	challenging_member_list = safe_load_json(group.challenging_member_list, {})
-	for item in challenging_member_list.values():
-		if item.get(str(challenger)) != None and item.get(str(challenger)).get('tree'):
-			raise GroupError('您已经在树上了')
 
 
 	if (behalf is None) and (behalf_is_member is None):
@@ -962,7 +999,7 @@ def query_tree(self, group_id: Groupid, user_id: QQid, boss_id=0) -> dict:
 	if group is None: raise GroupNotExist
 	user = User.get_or_none(qqid=user_id)
 	if user is None: raise GroupError('请先加入公会')
-	challenging_member_list = safe_load_json(group.challenging_member_list, {})
+	challenging_member_list = group_state(self, group).challenging
 	result = {"1": [], "2": [], "3": [], "4": [], "5": []}
 	if boss_id == 0:
 		for i in range(1, 6):
@@ -994,15 +1031,7 @@ def check_tree(self, group_id: Groupid, user_id: QQid):
 	if group is None: raise GroupNotExist
 	user = User.get_or_none(qqid=user_id)
 	if user is None: raise GroupError('请先加入公会')
-	challenging_member_list = safe_load_json(group.challenging_member_list, {})
-	for i in range(1, 6):
-		try:
-			for qid in challenging_member_list[str(i)]:
-				if challenging_member_list[str(i)][qid]['tree']:
-					return i
-		except KeyError:
-			continue
-	return False
+	return group_state(self, group).tree_boss
 
 
 #下树
@@ -1054,8 +1083,9 @@ def take_it_of_the_tree(self, group_id: Groupid, qqid: QQid, boss_num=0, take_it
 def check_next_boss(self, group_id:Groupid, boss_num):
 	group:Clan_group = get_clan_group(self, group_id)
 	boss_cycle = group.boss_cycle
-	now_cycle_boss_health = safe_load_json(group.now_cycle_boss_health, {})
-	next_cycle_boss_health = safe_load_json(group.next_cycle_boss_health, {})
+	state = group_state(self, group)
+	now_cycle_boss_health = state.now_health
+	next_cycle_boss_health = state.next_health
 	if now_cycle_boss_health[boss_num] == 0 and next_cycle_boss_health[boss_num] == 0:
 		return False
 	if self._level_by_cycle(boss_cycle, group.game_server) != self._level_by_cycle(boss_cycle+1, group.game_server):
@@ -1084,7 +1114,7 @@ def apply_for_challenge(self, is_continue, group_id:Groupid, qqid:QQid, boss_num
 	if self.check_blade(group_id, challenger):
 		raise GroupError('你已经申请过了 (╯‵□′)╯︵┻━┻')
 
-	now_cycle_boss_health = safe_load_json(group.now_cycle_boss_health, {})
+	now_cycle_boss_health = group_state(self, group).now_health
 	if (not check_next_boss(self, group_id, boss_num) 
 		and now_cycle_boss_health[boss_num] == 0):
 		raise GroupError('只能挑战2个周目内且不跨阶段的同个boss，请等待该周目的boss全部击杀完毕')
@@ -1177,11 +1207,7 @@ def check_blade(self, group_id: Groupid, qqid: QQid):
 	"""
 	group:Clan_group = get_clan_group(self, group_id)
 	if group is None: raise GroupNotExist
-	challenging_list = safe_load_json(group.challenging_member_list, {})
-	for _, infos in challenging_list.items():
-		for challenger in infos.keys():
-			if str(qqid) == challenger : return True
-	return False
+	return group_state(self, group).boss_of(qqid) is not None
 
 #获取boss_num
 def get_in_boss_num(self, group_id, qqid):
@@ -1192,11 +1218,8 @@ def get_in_boss_num(self, group_id, qqid):
 		qqid: 需要进行操作的QQ号
 	"""
 	group:Clan_group = get_clan_group(self, group_id)
-	challenging_list = safe_load_json(group.challenging_member_list, {})
-	for boss_num, infos in challenging_list.items():
-		for challenger in infos.keys():
-			if str(qqid) == challenger : return boss_num
-	return False
+	boss_num = group_state(self, group).boss_of(qqid)
+	return boss_num if boss_num is not None else False
 
 
 #SL
@@ -1293,10 +1316,11 @@ def challenger_info_small(self, group:Clan_group, boss_num, msg:List = None):
 		group: 公会信息对象
 		boss_num: 几王
 	"""
-	now_health = safe_load_json(group.now_cycle_boss_health)[boss_num]
-	next_health = safe_load_json(group.next_cycle_boss_health)[boss_num]
+	state = group_state(self, group)
+	now_health = state.now_health[boss_num]
+	next_health = state.next_health[boss_num]
 
-	challenging_list = safe_load_json(group.challenging_member_list)
+	challenging_list = state.challenging
 	if challenging_list and (boss_num in challenging_list): 
 		challenging_list = challenging_list[boss_num]
 	else:
@@ -1335,10 +1359,13 @@ def challenger_info_small(self, group:Clan_group, boss_num, msg:List = None):
 	return msg
 
 #总出刀信息
-def challenger_info(self, group_id):
+@timed('challenger_info_data')
+def _challenger_info_data(self, group_id):
 	"""
-	Args:
-		group: 公会信息对象
+	收集出状态图所需的数据  需要访问数据库  须在事件循环所在线程中调用
+
+	Returns:
+		(boss数据, 1~5王的挑战/挂树/预约信息, 公会信息)
 	"""
 	clanInfo = {
 		"finishChallengeCount": 0,
@@ -1376,9 +1403,9 @@ def challenger_info(self, group_id):
 			continue
 		half_challenge_list[str(qqid)] = f'{self._get_nickname_by_qqid(qqid)}'+ (f' x {num}' if num else '')
 
-	challenging_list = safe_load_json(group.challenging_member_list)
+	challenging_list = group_state(self, group).challenging
 	group_boss_data = self._boss_data_dict(group)
-	boss_state_image_list = []
+	extra_info_list = []
 	subscribe_handler = SubscribeHandler(group=group)
 
 	clanInfo["halfChallengeCount"] =len(half_challenge_list)
@@ -1415,9 +1442,34 @@ def challenger_info(self, group_id):
 			for user_id, note in subscribe_list.items():
 				extra_info["预约"][str(user_id)] = self._get_nickname_by_qqid(user_id) + (f":{note}" if note else "")
 		# print(extra_info)
-		boss_state_image_list.append(boss_statue_draw(group_boss_data[boss_num]['icon_id'], extra_info))
+		extra_info_list.append(extra_info)
 	clanInfo["levelCycle"] = self._level_by_cycle(group.boss_cycle, group.game_server)
 	clanInfo["bossCycle"] = group.boss_cycle
+	return group_boss_data, extra_info_list, clanInfo
+
+@timed('render_key')
+def _challenger_info_key(group_boss_data, extra_info_list, clanInfo, settings, base_url) -> str:
+	avatar_qqids = [qqid for extra_info in extra_info_list for state in extra_info.values() for qqid in state]
+	versions = avatar_versions(headPicturePath, avatar_qqids)
+	# 出图可能在其他进程中进行  缺失的头像在这里登记
+	mark_missing_user_profile(int(qqid) for qqid, version in versions.items() if version is None)
+	return render_key(group_boss_data, extra_info_list, clanInfo, versions, settings, base_url)
+
+def challenger_info(self, group_id):
+	"""
+	Args:
+		group: 公会信息对象
+	"""
+	group_boss_data, extra_info_list, clanInfo = _challenger_info_data(self, group_id)
+	settings = output_settings(self.setting, group_id)
+	base_url = _image_base_url(self)
+
+	# 输入没有变化时直接返回上一次的结果
+	cache_key = _challenger_info_key(group_boss_data, extra_info_list, clanInfo, settings, base_url)
+	cached = render_cache.get(group_id, cache_key)
+	if cached is not None:
+		return cached
+
 	# try:
 	# 	_bg_color = [(132, 1, 244), (115, 166, 231), (206, 105, 165), (206, 80, 66), (181, 105, 206)][level_cycle]
 	# except IndexError:
@@ -1443,15 +1495,23 @@ def challenger_info(self, group_id):
 	# )
 	# # process_image.show()
 	# result_image = generate_combind_boss_state_image([process_image, *boss_state_image_list])
-	result_image = state_image_generate(group_boss_data, boss_state_image_list, clanInfo)
-	if result_image.mode != "RGB":
-		result_image = result_image.convert("RGB")
-	bio = BytesIO()
-	result_image.save(bio, format='JPEG', quality=95)
-	result_image.close()
-	base64_str = 'base64://' + base64.b64encode(bio.getvalue()).decode()
-	bio.close()
-	return f"[CQ:image,file={base64_str}]"
+	result = render_state_image(group_id, group_boss_data, extra_info_list, clanInfo, settings, base_url, self.setting.get('render_mode', 'incremental'))
+	render_cache.put(group_id, cache_key, result)
+	return result
+
+async def challenger_info_async(self, group_id):
+	"""
+	与 challenger_info 相同  但出图在出图执行器中进行  等待期间事件循环可以继续处理其他指令
+	"""
+	group_boss_data, extra_info_list, clanInfo = _challenger_info_data(self, group_id)
+	settings = output_settings(self.setting, group_id)
+	base_url = _image_base_url(self)
+	cache_key = _challenger_info_key(group_boss_data, extra_info_list, clanInfo, settings, base_url)
+	cached = render_cache.get(group_id, cache_key)
+	if cached is not None:
+		return cached
+	# 同一个群并发的请求共享同一次出图  结果由合并器写入缓存
+	return await render_coalescer.render(group_id, cache_key, render_state_image, group_id, group_boss_data, extra_info_list, clanInfo, settings, base_url, self.setting.get('render_mode', 'incremental'))
 
 #出刀记录
 def challenge_record(self, group_id):
@@ -1459,46 +1519,8 @@ def challenge_record(self, group_id):
 	if group is None : raise GroupNotExist
 	date, _ = pcr_datetime(area = group.game_server)
 	members:List[Clan_member] = Clan_member.select().where(Clan_member.group_id == group_id)
-
-	total_blade_num = 0				#总出刀数
-	total_continue_blade_num = 0	#总补偿刀数量
-	zero_blade_members = []			#一刀没出的成员
-	blade_list = {}
-	for member in members:
-		challenge_records:List[Clan_challenge] = Clan_challenge.select().where(
-			Clan_challenge.gid == group_id,
-			Clan_challenge.bid == group.battle_id,
-			Clan_challenge.challenge_pcrdate == date,
-			Clan_challenge.qqid == member.qqid
-		).order_by(Clan_challenge.cid)
-		if len(challenge_records) != 0:
-			member_num = 0			#单个成员出刀数
-			continue_blade_num = 0	#单个成员剩余补偿刀数量
-			for c in challenge_records:
-				if c.boss_health_remain == 0 and not c.is_continue:	#完整刀收尾算0.5刀
-					member_num += 0.5
-					continue_blade_num += 1
-				elif c.is_continue:	#补偿刀算0.5刀
-					member_num += 0.5
-					continue_blade_num -= 1
-				else: member_num += 1
-			total_blade_num += member_num
-			total_continue_blade_num += continue_blade_num
-			if member_num not in blade_list: blade_list[member_num] = 1
-			else: blade_list[member_num] += 1
-		else:
-			zero_blade_members.append(member.qqid)
-
-	back_msg = []
-	back_msg.append(f"待出补偿刀数量：{total_continue_blade_num}")
-	back_msg.append(f"已出0刀的成员数量：{len(zero_blade_members)}")
-	for i in range(len(zero_blade_members)):
-		name = self._get_nickname_by_qqid(zero_blade_members[i])
-		back_msg.append(f"{i == len(zero_blade_members)-1 and '┖' or '┣'}{name}")
-	for blade_num in blade_list.keys():
-		back_msg.append(f"已出{blade_num}刀：{blade_list[blade_num]}")
-	back_msg.append(f"今天已出 {total_blade_num}/{len(members)*3}")
-	return '\n'.join(back_msg)
+	blades = member_blades(Clan_challenge, group_id, group.battle_id, date)
+	return record_message([member.qqid for member in members], blades, self._get_nickname_by_qqid)
 
 
 ##获取报告
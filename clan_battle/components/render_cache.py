@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Union
+
+from .image_store import image_store
+
+
+def avatar_versions(profile_path: Path, qqids: Iterable[Union[str, int]]) -> Dict[str, Optional[int]]:
+	"""
+	获取头像文件的版本(修改时间)  头像缺失时为None  头像下载完成后缓存自然失效
+
+	:param profile_path: 头像目录
+	:param qqids: 需要的qq号
+	"""
+	versions = {}
+	for qqid in qqids:
+		qqid = str(qqid)
+		if qqid in versions: continue
+		try:
+			versions[qqid] = os.stat(profile_path.joinpath(qqid + ".jpg")).st_mtime_ns
+		except OSError:
+			versions[qqid] = None
+	return versions
+
+
+def render_key(*parts: Any) -> str:
+	"""
+	由出图所需的全部输入计算稳定的哈希值  输入相同则哈希相同  与字典的插入顺序无关
+	"""
+	raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+	return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+	"""
+	状态图输出缓存
+	以 群号 + 输入哈希 为键保存编码好的CQ码  输入没有变化时直接返回上一次的结果  不再重新出图和编码
+
+	:param entries_per_group: 每个群最多保存的结果数
+	:param max_bytes: 所有群合计最多占用的字符数  超出后按最久未使用淘汰
+	:param check: 命中时检查结果是否仍然可用  不可用时丢弃并视为未命中  如以地址发送的图片已被图片库清理
+	"""
+
+	def __init__(self, entries_per_group: int = 2, max_bytes: int = 64 * 1024 * 1024,
+				 check: Optional[Callable[[str], bool]] = None) -> None:
+		self.entries_per_group = entries_per_group
+		self.max_bytes = max_bytes
+		self.check = check
+		self.__entries: 'OrderedDict[Tuple[int, str], str]' = OrderedDict()
+		self.__lock = threading.Lock()
+		self.__size = 0
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, group_id: int, key: str) -> Optional[str]:
+		with self.__lock:
+			value = self.__entries.get((group_id, key))
+			if value is None:
+				self.misses += 1
+				return None
+			self.__entries.move_to_end((group_id, key))
+		# 检查可能读写文件  不占用锁
+		if self.check is not None and not self.check(value):
+			with self.__lock:
+				if self.__entries.get((group_id, key)) is value:
+					self.__size -= len(self.__entries.pop((group_id, key)))
+				self.misses += 1
+			return None
+		with self.__lock:
+			self.hits += 1
+		return value
+
+	def put(self, group_id: int, key: str, value: str) -> None:
+		if len(value) > self.max_bytes: return
+		with self.__lock:
+			old = self.__entries.pop((group_id, key), None)
+			if old is not None: self.__size -= len(old)
+			self.__entries[(group_id, key)] = value
+			self.__size += len(value)
+			group_keys = [k for k in self.__entries if k[0] == group_id]
+			for k in group_keys[:-self.entries_per_group]:
+				self.__size -= len(self.__entries.pop(k))
+			while self.__size > self.max_bytes:
+				_, evicted = self.__entries.popitem(last=False)
+				self.__size -= len(evicted)
+
+	def invalidate(self, group_id: Optional[int] = None) -> None:
+		"""
+		清除缓存
+
+		:param group_id: 只清除该群的缓存  None为全部清除
+		"""
+		with self.__lock:
+			for k in [k for k in self.__entries if group_id is None or k[0] == group_id]:
+				self.__size -= len(self.__entries.pop(k))
+
+	def stats(self) -> Dict[str, int]:
+		with self.__lock:
+			return {
+				'entries': len(self.__entries),
+				'bytes': self.__size,
+				'hits': self.hits,
+				'misses': self.misses,
+			}
+
+
+render_cache = RenderCache(check=image_store.touch_reply)
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..exception import ClanBattleError
+from .imageEngine.imageEngine import state_image_update, state_image_canvas
+from .imageEngine.canvas_pool import canvas_pool
+from .imageEngine.timing import timed, span
+from .render_cache import RenderCache, render_cache
+from .output_encoder import OutputSettings, DEFAULT_OUTPUT
+from .image_store import image_reply
+
+_logger = logging.getLogger(__name__)
+
+
+class RenderBusy(ClanBattleError):
+	pass
+
+
+@timed()
+def render_state_image(group_id: int, group_boss_data: Dict[int, Any], extra_info_list: List[dict], clanInfo: Dict[str, int],
+					   settings: OutputSettings = DEFAULT_OUTPUT['state'], base_url: Optional[str] = None, mode: str = 'incremental') -> str:
+	"""
+	生成状态图并编码为CQ码
+	只依赖传入的数据  不访问数据库  可以在线程池或进程池中运行
+	同时出图的帧数受 canvas_pool 限制  超出时等待
+
+	:param base_url: 图片路由的地址  为None时以base64内联发送
+	:param mode: incremental 保留每个群的上一帧  只重绘变化的区域  每个群常驻约12MB
+				 pooled 低内存模式  每次完整重绘到复用的RGB画布上  不保留上一帧
+	"""
+	if mode == 'pooled':
+		with state_image_canvas(group_boss_data, extra_info_list, clanInfo) as result_image:
+			return image_reply(result_image, settings, base_url, group_id)
+	with canvas_pool.slot():
+		result_image = state_image_update(group_id, group_boss_data, extra_info_list, clanInfo)
+		result = image_reply(result_image, settings, base_url, group_id)
+	result_image.close()
+	return result
+
+
+class RenderExecutor:
+	"""
+	出图执行器
+	Pillow出图会阻塞事件循环  交给线程池或进程池执行  事件循环在此期间继续处理其他群的指令和网页请求
+
+	:param kind: thread 或 process  进程池可以用满多核  但每个进程各自维护贴图和画面缓存
+	:param workers: 工作线程/进程数
+	:param max_pending: 最多同时排队及执行的任务数  超出后直接拒绝
+	:param timeout: 单次出图的超时时间(秒)
+	"""
+
+	def __init__(self, kind: str = 'thread', workers: int = 2, max_pending: int = 8, timeout: float = 30) -> None:
+		self.kind = kind
+		self.workers = workers
+		self.max_pending = max_pending
+		self.timeout = timeout
+		self.pending = 0
+		self.__executor: Optional[Executor] = None
+
+	def configure(self, kind: Optional[str] = None, workers: Optional[int] = None,
+				  max_pending: Optional[int] = None, timeout: Optional[float] = None) -> None:
+		"""
+		修改配置  已创建的线程池/进程池会在下次使用时按新配置重建
+		"""
+		if kind is not None: self.kind = kind
+		if workers is not None: self.workers = workers
+		if max_pending is not None: self.max_pending = max_pending
+		if timeout is not None: self.timeout = timeout
+		self.shutdown()
+
+	@property
+	def executor(self) -> Executor:
+		if self.__executor is None:
+			if self.kind == 'process':
+				self.__executor = ProcessPoolExecutor(max_workers=self.workers)
+			else:
+				self.__executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='clan_battle_render')
+		return self.__executor
+
+	async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+		"""
+		在执行器中运行出图函数并等待结果
+
+		:raise RenderBusy: 排队任务过多或出图超时
+		"""
+		if self.pending >= self.max_pending:
+			raise RenderBusy('当前出图任务过多，请稍后再试')
+		self.pending += 1
+		try:
+			future = asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+		except BaseException:
+			self.pending -= 1
+			raise
+		# 超时后出图仍在执行器中运行  要等它真正结束才减少计数  否则超时的任务会继续占着执行器而不计入排队
+		future.add_done_callback(self.__release)
+		try:
+			# 包含排队等待的时间  与 render_state_image 的差即为排队耗时
+			with span('render_executor'):
+				# 超时只让等待者放弃  不取消执行器中的任务
+				return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+		except asyncio.TimeoutError:
+			_logger.warning(f'出图超时 {func.__name__}')
+			raise RenderBusy('出图超时，请稍后再试')
+
+	def __release(self, future: 'asyncio.Future[Any]') -> None:
+		self.pending -= 1
+		if not future.cancelled():
+			# 等待者已放弃时取走异常  避免 "exception was never retrieved" 日志
+			future.exception()
+
+	def shutdown(self) -> None:
+		if self.__executor is not None:
+			self.__executor.shutdown(wait=False)
+			self.__executor = None
+
+
+render_executor = RenderExecutor()
+
+
+class _Flight:
+	def __init__(self, key: str, func: Callable[..., Any], args: Tuple[Any, ...]) -> None:
+		self.key = key
+		self.func = func
+		self.args = args
+		self.future = asyncio.get_event_loop().create_future()
+
+
+class RenderCoalescer:
+	"""
+	按群合并并发的出图请求  每个群同一时间最多一个正在出图的任务和一个排队的任务
+	输入相同(键相同)的请求共享正在进行的出图
+	输入不同的请求进入排队  排队期间再有新请求时直接替换为最新的输入  旧的排队任务不再出图  所有排队中的请求都得到最新状态的图
+	只在事件循环中使用  无需加锁
+
+	:param executor: 出图执行器
+	:param cache: 出图完成后写入的输出缓存
+	"""
+
+	def __init__(self, executor: RenderExecutor, cache: Optional[RenderCache] = None) -> None:
+		self.executor = executor
+		self.cache = cache
+		self.__running: Dict[Any, _Flight] = {}
+		self.__queued: Dict[Any, _Flight] = {}
+		self.shared = 0
+		self.dropped = 0
+
+	async def render(self, group_id: Any, key: str, func: Callable[..., Any], *args: Any) -> Any:
+		"""
+		出图  同一个群的并发请求会被合并
+
+		:param group_id: 群号
+		:param key: 出图输入的哈希值
+		:param func: 出图函数  须可在执行器中运行
+		"""
+		running = self.__running.get(group_id)
+		if running is None:
+			flight = _Flight(key, func, args)
+			self.__running[group_id] = flight
+			asyncio.ensure_future(self.__run(group_id, flight))
+			return await asyncio.shield(flight.future)
+		if running.key == key:
+			self.shared += 1
+			return await asyncio.shield(running.future)
+		queued = self.__queued.get(group_id)
+		if queued is None:
+			queued = _Flight(key, func, args)
+			self.__queued[group_id] = queued
+		elif queued.key != key:
+			# 最新的输入覆盖排队中的旧输入
+			queued.key, queued.func, queued.args = key, func, args
+			self.dropped += 1
+		else:
+			self.shared += 1
+		return await asyncio.shield(queued.future)
+
+	async def __run(self, group_id: Any, flight: _Flight) -> None:
+		try:
+			result = await self.executor.run(flight.func, *flight.args)
+		except Exception as e:
+			flight.future.set_exception(e)
+			# 没有人等待时不再报 Future exception was never retrieved
+			flight.future.exception()
+		else:
+			if self.cache is not None:
+				self.cache.put(group_id, flight.key, result)
+			flight.future.set_result(result)
+		finally:
+			queued = self.__queued.pop(group_id, None)
+			if queued is None:
+				del self.__running[group_id]
+			else:
+				self.__running[group_id] = queued
+				asyncio.ensure_future(self.__run(group_id, queued))
+
+	def stats(self) -> Dict[str, int]:
+		return {
+			'running': len(self.__running),
+			'queued': len(self.__queued),
+			'shared': self.shared,
+			'dropped': self.dropped,
+		}
+
+
+render_coalescer = RenderCoalescer(render_executor, render_cache)
@@ -85,4 +85,4 @@ def score_table(self, group_id):
 尾刀：{info['end_blade']}     \
 小尾刀：{info['small_end_blade']}")
 
-	return self.text_2_pic('\n'.join(back_msg), 450, len(back_msg)*20 + 10, (255, 255, 255), "#000000", 15, (10, 5))
+	return self.text_2_pic('\n'.join(back_msg), 450, len(back_msg)*20 + 10, (255, 255, 255), "#000000", 15, (10, 5), group_id)
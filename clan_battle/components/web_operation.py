@@ -10,6 +10,7 @@ from ...ybdata import Clan_group, Clan_member, User
 from ..exception import ClanBattleError
 from ..util import pcr_datetime, atqq
 from .multi_cq_utils import who_am_i
+from .image_store import image_store
 
 _logger = logging.getLogger(__name__)
 
@@ -724,4 +725,48 @@ def register_routes(self, app: Quart):
 				return await render_template('clan/unauthorized.html')
 		return await render_template(
 			'clan/clan-rank.html',
-		)
\ No newline at end of file
+		)
+	@app.route(
+		urljoin(self.setting['public_basepath'],
+				'clan/image/<name>'),
+		methods=['GET'])
+	async def yobot_clan_image(name):
+		# 文件名即图片内容的哈希,内容不会变化,可以永久缓存
+		found = image_store.get(name)
+		if found is None:
+			return await render_template('404.html', item='图片'), 404
+		etag = '"{}"'.format(name.split('.')[0])
+		if etag in request.headers.get('If-None-Match', ''):
+			response = await make_response('', 304)
+		else:
+			path, mimetype = found
+			data = await asyncio.get_event_loop().run_in_executor(None, path.read_bytes)
+			response = await make_response(data)
+			response.headers['Content-Type'] = mimetype
+		response.headers['ETag'] = etag
+		response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+		return response
+
+	@app.route(
+		urljoin(self.setting['public_basepath'],
+				'clan/<int:group_id>/status-image/'),
+		methods=['GET'])
+	async def yobot_clan_status_image(group_id):
+		group = self.get_clan_group(group_id=group_id)
+		if group is None:
+			return await render_template('404.html', item='公会'), 404
+		if not(group.privacy & 0x1):
+			if 'yobot_user' not in session:
+				return redirect(url_for('yobot_login', callback=request.path))
+			user = User.get_by_id(session['yobot_user'])
+			is_member = Clan_member.get_or_none(
+				group_id=group_id, qqid=session['yobot_user'])
+			if (not is_member and user.authority_group >= 10):
+				return await render_template('clan/unauthorized.html')
+		# 最近一次发送的状态图,不重新出图
+		name = image_store.latest(group_id)
+		if name is None:
+			return await render_template('404.html', item='状态图'), 404
+		response = redirect(url_for('yobot_clan_image', name=name))
+		response.headers['Cache-Control'] = 'no-cache'
+		return response
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# clan_battle 在 yobot 中是子包  这里把仓库根目录加入路径  以 clan_battle.components... 导入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
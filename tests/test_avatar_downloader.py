@@ -0,0 +1,150 @@
+import asyncio
+import io
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from PIL import Image
+
+from clan_battle.components.imageEngine.avatar_downloader import AvatarDownloader
+
+
+def _jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 40), (200, 120, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class StandIn:
+    """
+    本地替身头像服务器
+    statuses[QQ号] 为依次返回的状态码  用完后返回200和图片
+    记录每个请求的到达时间、同时处理的请求数、客户端连接(端口)
+    """
+
+    def __init__(self) -> None:
+        self.jpeg = _jpeg()
+        self.delay = 0.0
+        self.statuses = {}
+        self.requests = []
+        self.ports = set()
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        standIn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                qqid = parse_qs(urlsplit(self.path).query)["nk"][0]
+                with standIn.lock:
+                    standIn.requests.append((time.monotonic(), qqid))
+                    standIn.ports.add(self.client_address[1])
+                    standIn.active += 1
+                    standIn.peak = max(standIn.peak, standIn.active)
+                    statuses = standIn.statuses.get(qqid)
+                    status = statuses.pop(0) if statuses else 200
+                try:
+                    time.sleep(standIn.delay)
+                    body = standIn.jpeg if status == 200 else b"busy"
+                    self.send_response(status)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with standIn.lock:
+                        standIn.active -= 1
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/g?nk={{qqid}}"
+
+    def count(self, qqid) -> int:
+        return sum(1 for _, requested in self.requests if requested == str(qqid))
+
+
+@pytest.fixture
+def standIn():
+    server = StandIn()
+    thread = threading.Thread(target=server.server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def run(downloader: AvatarDownloader, *batches):
+    """
+    依次下载各批QQ号  返回各批的结果
+    """
+
+    async def main():
+        try:
+            return [await downloader.download(user_ids, folder) for user_ids, folder in batches]
+        finally:
+            await downloader.aclose()
+
+    return asyncio.run(main())
+
+
+def test_retry_with_backoff(standIn, tmp_path):
+    standIn.statuses = {"1": [429, 503], "2": [500, 502, 504]}
+    downloader = AvatarDownloader(url=standIn.url, rate=0, retries=2, backoff=0.05)
+    start = time.monotonic()
+    (result,) = run(downloader, ([1, 2], tmp_path))
+    assert result[0] == tmp_path.joinpath("1.jpg") and result[0].exists()
+    assert result[1] is None and not tmp_path.joinpath("2.jpg").exists()
+    assert standIn.count(1) == 3
+    assert standIn.count(2) == 3
+    assert downloader.stats()["retried"] == 4
+    # 两次退避  0.05 + 0.1 秒起
+    assert time.monotonic() - start >= 0.15
+    times = [at for at, qqid in standIn.requests if qqid == "1"]
+    assert times[1] - times[0] >= 0.05 * 0.9
+    assert times[2] - times[1] >= 0.1 * 0.9
+
+
+def test_concurrency_cap(standIn, tmp_path):
+    standIn.delay = 0.05
+    downloader = AvatarDownloader(url=standIn.url, concurrency=3, rate=0)
+    (result,) = run(downloader, (range(1, 16), tmp_path))
+    assert all(path is not None for path in result)
+    assert len(standIn.requests) == 15
+    assert 1 < standIn.peak <= 3
+
+
+def test_host_rate_limit(standIn, tmp_path):
+    rate = 20
+    downloader = AvatarDownloader(url=standIn.url, concurrency=8, rate=rate)
+    (result,) = run(downloader, (range(1, 9), tmp_path))
+    assert all(path is not None for path in result)
+    times = sorted(at for at, _ in standIn.requests)
+    assert len(times) == 8
+    # 并发数足够  仍然按每秒 rate 个请求依次发出
+    assert times[-1] - times[0] >= (len(times) - 1) / rate * 0.9
+
+
+def test_single_client_reused(standIn, tmp_path):
+    standIn.delay = 0.01
+    downloader = AvatarDownloader(url=standIn.url, concurrency=2, rate=0)
+    clients = []
+
+    async def main():
+        try:
+            for batch in (range(1, 9), range(9, 17)):
+                await downloader.download(batch, tmp_path)
+                clients.append(downloader.client)
+        finally:
+            await downloader.aclose()
+
+    asyncio.run(main())
+    assert len(standIn.requests) == 16
+    assert clients[0] is clients[1]
+    # 两批共16个请求都复用连接池里的连接
+    assert len(standIn.ports) <= 2
@@ -0,0 +1,51 @@
+import pytest
+
+from clan_battle.components import challenge_tally_benchmark as fixture
+from clan_battle.components.challenge_tally_benchmark import BATTLE_ID, BLADE_PATTERNS, GROUP_ID, PCRDATE
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = fixture.open_database(str(tmp_path / "yobot.db"))
+    yield db
+    db.close()
+
+
+def nickname(qqid):
+    return f"成员{qqid}"
+
+
+@pytest.mark.parametrize("patterns", [BLADE_PATTERNS, BLADE_PATTERNS[::-1]], ids=["float_first", "int_first"])
+def test_same_reply_as_per_member_loop(db, patterns):
+    fixture.seed(patterns=patterns)
+    legacy = fixture.legacy_record(GROUP_ID, BATTLE_ID, PCRDATE, nickname)
+    current = fixture.current_record(GROUP_ID, BATTLE_ID, PCRDATE, nickname)
+    assert current == legacy
+    # 出刀数的类型与逐个成员累加时相同  3 与 3.0 按先出现的成员显示
+    if patterns == BLADE_PATTERNS:
+        assert "已出3.0刀：14" in current.split("\n")
+    else:
+        assert "已出3刀：14" in current.split("\n")
+    assert "已出1.0刀：7" in current.split("\n")
+    assert current.split("\n")[:4] == ["待出补偿刀数量：7", "已出0刀的成员数量：2", "┣成员10028", "┖成员10029"]
+    assert current.split("\n")[-1] == "今天已出 66.5/90"
+
+
+def test_query_count(db):
+    fixture.seed()
+    _, legacy_queries, _ = fixture.measure(db, fixture.legacy_record, 1)
+    _, current_queries, _ = fixture.measure(db, fixture.current_record, 1)
+    assert legacy_queries == 1 + fixture.MEMBER_NUM
+    assert current_queries == 2
+
+
+def test_other_days_and_groups_ignored(db):
+    fixture.seed(noise=0)
+    quiet = fixture.current_record(GROUP_ID, BATTLE_ID, PCRDATE, nickname)
+    db.close()
+    database = fixture.open_database(db.database + ".noise")
+    try:
+        fixture.seed(noise=3000)
+        assert fixture.current_record(GROUP_ID, BATTLE_ID, PCRDATE, nickname) == quiet
+    finally:
+        database.close()
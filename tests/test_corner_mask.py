@@ -0,0 +1,32 @@
+import random
+
+import pytest
+from PIL import Image
+
+from clan_battle.components.imageEngine.corner_mask import round_corner
+from clan_battle.components.imageEngine.benchmark import legacy_round_corner
+
+CASES = [(20, 20, 10), (120, 24, 12), (218, 20, 10), (65, 65, 10), (315, 24, None), (420, 300, 5), (20, 20, None), (10, 30, None)]
+
+
+def noise_image(width, height, mode):
+    channels = [Image.effect_noise((width, height), 80).convert("L") for _ in range(4)]
+    return Image.merge("RGBA", channels).convert(mode)
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "RGB"])
+@pytest.mark.parametrize("width,height,radius", CASES)
+def test_same_as_legacy(width, height, radius, mode):
+    image = noise_image(width, height, mode)
+    assert round_corner(image.copy(), radius).tobytes() == legacy_round_corner(image.copy(), radius).tobytes()
+
+
+def test_same_as_legacy_random():
+    rng = random.Random(20261018)
+    for _ in range(100):
+        width, height = rng.randint(8, 300), rng.randint(8, 200)
+        radius = rng.choice([None, 3, 5, 10])
+        if radius is not None and radius * 2 > min(width, height):
+            continue
+        image = noise_image(width, height, "RGBA")
+        assert round_corner(image.copy(), radius).tobytes() == legacy_round_corner(image.copy(), radius).tobytes()
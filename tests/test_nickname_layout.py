@@ -0,0 +1,67 @@
+import os
+import random
+
+import pytest
+
+from clan_battle.components.imageEngine import nickname_layout
+from clan_battle.components.imageEngine.font_registry import get_font
+from clan_battle.components.imageEngine.nickname_layout import nickname_slice
+
+pytestmark = pytest.mark.skipif(not os.path.exists(nickname_layout.fontPath), reason="缺少字体 Resource/tqxyt.ttf")
+
+
+def legacy_slice(names, max_row):
+    """
+    改写前 char_num_iteration_generation 的逐个尝试算法  作为对照
+    """
+    ICON_OFFSET = 30 + 2
+    ICON_GAP = 10
+    NONE_ID_ICON = 24
+    INFORMATION_WIDTH = 359
+    idWidth = 0
+    iconFont = get_font(nickname_layout.fontPath, 17)
+    for sliceNum in range(8, -1, -1):
+        rowNum = 1
+        for name in names:
+            if not sliceNum:
+                iconWidth = NONE_ID_ICON
+            elif len(name) > sliceNum:
+                fontBox = iconFont.getbbox(name[:sliceNum] + "..")
+                iconWidth = fontBox[2] - fontBox[0] + ICON_OFFSET
+            else:
+                fontBox = iconFont.getbbox(name)
+                iconWidth = fontBox[2] - fontBox[0] + ICON_OFFSET
+            idWidth += iconWidth + ICON_GAP
+            if idWidth > INFORMATION_WIDTH:
+                rowNum += 1
+                if not sliceNum:
+                    idWidth = NONE_ID_ICON + ICON_GAP
+                else:
+                    idWidth = iconWidth
+                if rowNum > max_row:
+                    idWidth = 0
+                    break
+        if rowNum <= max_row:
+            return sliceNum
+    return 0
+
+
+@pytest.mark.parametrize("names, max_row", [
+    # 截断后的 .. 比被截掉的字符更宽  短的截断反而放不下
+    (["!a", "wj", "!.", "Midmb|!m|", "Wd!mjaM"], 1),
+    (["iiiiiiiiii", "llllllllll", "!!!!!!!!!!", "||||||||||"], 1),
+    (["公会战", "WWWWWWWWWW", "mmmmmmmmmm"], 1),
+    ([], 1),
+    (["超长的中文昵称一二三四五六七八九十"] * 30, 3),
+])
+def test_nickname_slice_matches_legacy(names, max_row):
+    assert nickname_slice(names, max_row) == legacy_slice(names, max_row)
+
+
+def test_nickname_slice_random_names():
+    rng = random.Random(20261018)
+    alphabet = "il!|.,:;'jftrIJ1WMmw@#%&abcdefgh0123456789ABCD公会战骑士团长一二三四五六七八九十ーのアイウエオ"
+    for _ in range(2000):
+        names = ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))) for _ in range(rng.randint(1, 12))]
+        max_row = rng.randint(1, 3)
+        assert nickname_slice(names, max_row) == legacy_slice(names, max_row), (names, max_row)
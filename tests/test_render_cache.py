@@ -0,0 +1,68 @@
+import os
+
+from PIL import Image
+
+from clan_battle.components import image_store as image_store_module
+from clan_battle.components.image_store import ImageStore, image_reply
+from clan_battle.components.output_encoder import DEFAULT_OUTPUT
+from clan_battle.components.render_cache import RenderCache
+
+BASE_URL = "http://127.0.0.1:9222/clan/image/"
+
+
+def state_reply(color):
+    with Image.new("RGB", (64, 32), color) as image:
+        return image_reply(image, DEFAULT_OUTPUT["state"], BASE_URL, 1)
+
+
+def reply_file(store, reply):
+    return store.root / image_store_module.REPLY_PATTERN.match(reply).group(1)
+
+
+def test_cached_reply_after_prune(tmp_path, monkeypatch):
+    store = ImageStore(tmp_path, max_files=4)
+    monkeypatch.setattr(image_store_module, "image_store", store)
+    cache = RenderCache(check=store.touch_reply)
+
+    reply = state_reply((200, 0, 0))
+    cache.put(1, "key", reply)
+    assert cache.get(1, "key") == reply
+    # 其他群的状态图、文字图片挤满图片库  最早的状态图被清理
+    for i in range(32):
+        store.put(bytes([i]) * 64)
+    assert not reply_file(store, reply).exists()
+
+    # 引用的图片已不存在  不再返回失效的地址  重新出图后再次可用
+    assert cache.get(1, "key") is None
+    assert cache.stats()["entries"] == 0
+    again = state_reply((200, 0, 0))
+    assert again == reply and reply_file(store, again).exists()
+    cache.put(1, "key", again)
+    assert cache.get(1, "key") == again
+
+
+def test_cache_hit_keeps_file(tmp_path, monkeypatch):
+    store = ImageStore(tmp_path, max_files=4)
+    monkeypatch.setattr(image_store_module, "image_store", store)
+    cache = RenderCache(check=store.touch_reply)
+
+    reply = state_reply((0, 200, 0))
+    cache.put(1, "key", reply)
+    path = reply_file(store, reply)
+    os.utime(path, (0, 0))
+    for i in range(3):
+        store.put(bytes([i]) * 64)
+    # 命中时更新修改时间  常用的图片不会被当作旧图片清理
+    assert cache.get(1, "key") == reply
+    assert path.stat().st_mtime > 0
+    for i in range(3, 16):
+        store.put(bytes([i]) * 64)
+        cache.get(1, "key")
+    assert path.exists()
+
+
+def test_inline_reply_always_valid():
+    store = ImageStore(max_files=4)
+    cache = RenderCache(check=store.touch_reply)
+    cache.put(1, "key", "[CQ:image,file=base64://AAAA]")
+    assert cache.get(1, "key") == "[CQ:image,file=base64://AAAA]"